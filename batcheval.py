@@ -0,0 +1,188 @@
+"""NumPy evaluation of many positions at once, for offline analysis of position sets and scoring all the children
+of a node in one go. NumPy is optional: the game and the search don't need it, only this module does.
+
+    python batcheval.py --random 10000           # time it against GameState.evaluation on random positions
+    python batcheval.py --fens positions.txt     # score a file of FENs, one per line
+
+Positions are packed into an (N, 64) int8 array, squares a8 first like the UI board, +piece type for white and
+-piece type for black. Scores are centipawns from white's point of view.
+"""
+import argparse
+import random
+import time
+from engine import GameState
+from moves import BOARD_SQUARES, WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from evaluation import (MIDDLEGAME_SCORES, ENDGAME_SCORES, PHASE, MAX_PHASE, DOUBLED_PAWN_PENALTY,
+                        ISOLATED_PAWN_PENALTY, PASSED_PAWN_BONUS)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MOBILITY_WEIGHT = 2  # Per pseudo-legal knight, bishop, rook and queen move
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+ORTHOGONAL_STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+DIAGONAL_STEPS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+def buildTables():
+    """Signed code lookup and the piece-square scores re-indexed as [signed code + 6][0..63 square]"""
+    signed = np.zeros(BLACK | KING + 1, dtype=np.int8)  # Mailbox piece code -> signed code
+    middlegame = np.zeros((13, 64), dtype=np.int32)
+    endgame = np.zeros((13, 64), dtype=np.int32)
+    phase = np.zeros(13, dtype=np.int32)
+    for pieceType in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+        for color, sign in ((WHITE, 1), (BLACK, -1)):
+            code = color | pieceType
+            signed[code] = sign * pieceType
+            for i, sq in enumerate(BOARD_SQUARES):
+                middlegame[sign * pieceType + 6, i] = MIDDLEGAME_SCORES[code][sq]
+                endgame[sign * pieceType + 6, i] = ENDGAME_SCORES[code][sq]
+            phase[sign * pieceType + 6] = PHASE[code]
+    return signed, middlegame, endgame, phase
+
+if np is not None:
+    SIGNED_CODES, MIDDLEGAME_TABLE, ENDGAME_TABLE, PHASE_TABLE = buildTables()
+    BOARD_INDEX = np.array(BOARD_SQUARES)  # 0..63 square -> mailbox square
+    SQUARE_NUMBERS = np.arange(64)
+    ROWS = np.arange(8).reshape(1, 8, 1)
+
+def requireNumpy():
+    if np is None:
+        raise ImportError("batcheval needs NumPy: pip install numpy")
+
+def packPositions(states):
+    """(N, 64) int8 boards of a list of GameStates"""
+    requireNumpy()
+    boards = np.empty((len(states), 64), dtype=np.int8)
+    for i, gs in enumerate(states):
+        boards[i] = SIGNED_CODES[np.frombuffer(gs.mailbox, dtype=np.uint8)[BOARD_INDEX]]
+    return boards
+
+def shift(squares, rowStep, colStep):
+    """(N, 8, 8) array moved by rowStep rows and colStep columns, what moves off the board is dropped"""
+    moved = np.zeros_like(squares)
+    moved[:, max(rowStep, 0):8 + min(rowStep, 0), max(colStep, 0):8 + min(colStep, 0)] = \
+        squares[:, max(-rowStep, 0):8 + min(-rowStep, 0), max(-colStep, 0):8 + min(-colStep, 0)]
+    return moved
+
+def mobility(squares, sign):
+    """Pseudo-legal knight, bishop, rook and queen moves of one side, per position. Sliders walk their rays a step
+    at a time for every position together; two sliders never share a ray in the same direction, since the nearer
+    one blocks the other, so the moves are counted exactly."""
+    own = squares * sign > 0
+    empty = squares == 0
+    moves = np.zeros(len(squares), dtype=np.int32)
+    knights = squares == sign * KNIGHT
+    for rowStep, colStep in KNIGHT_STEPS:
+        moves += (shift(knights, rowStep, colStep) & ~own).sum(axis=(1, 2))
+    for sliders, steps in (((ROOK, QUEEN), ORTHOGONAL_STEPS), ((BISHOP, QUEEN), DIAGONAL_STEPS)):
+        origins = (squares == sign * sliders[0]) | (squares == sign * sliders[1])
+        for rowStep, colStep in steps:
+            reach = origins
+            for _ in range(7):
+                reach = shift(reach, rowStep, colStep)
+                moves += (reach & ~own).sum(axis=(1, 2))
+                reach = reach & empty  # Stops on the first piece, after counting it if it can be captured
+    return moves
+
+def pawnStructure(squares):
+    """Doubled, isolated and passed pawn score per position, white minus black"""
+    whitePawns, blackPawns = squares == PAWN, squares == -PAWN
+    score = np.zeros(len(squares), dtype=np.int32)
+    for pawns, sign in ((whitePawns, 1), (blackPawns, -1)):
+        files = pawns.sum(axis=1)  # (N, 8) pawns per file
+        doubled = np.clip(files - 1, 0, None).sum(axis=1)
+        present = np.pad(files > 0, ((0, 0), (1, 1)))
+        isolated = (files * ~(present[:, :-2] | present[:, 2:])).sum(axis=1)
+        score -= sign * (DOUBLED_PAWN_PENALTY * doubled + ISOLATED_PAWN_PENALTY * isolated)
+    # A white pawn is passed when no black pawn stands on a row above it on its own or the next files
+    blackFront = np.where(blackPawns, ROWS, 8).min(axis=1)  # (N, 8) most advanced-for-white black pawn row
+    blackFront = np.minimum(blackFront, np.minimum(np.pad(blackFront, ((0, 0), (1, 0)), constant_values=8)[:, :-1],
+                                                   np.pad(blackFront, ((0, 0), (0, 1)), constant_values=8)[:, 1:]))
+    whitePassed = whitePawns & (blackFront[:, None, :] >= ROWS)
+    whiteBack = np.where(whitePawns, ROWS, -1).max(axis=1)
+    whiteBack = np.maximum(whiteBack, np.maximum(np.pad(whiteBack, ((0, 0), (1, 0)), constant_values=-1)[:, :-1],
+                                                 np.pad(whiteBack, ((0, 0), (0, 1)), constant_values=-1)[:, 1:]))
+    blackPassed = blackPawns & (whiteBack[:, None, :] <= ROWS)
+    bonus = np.array(PASSED_PAWN_BONUS, dtype=np.int32).reshape(1, 8, 1)
+    score += (whitePassed * bonus).sum(axis=(1, 2)) - (blackPassed * bonus[:, ::-1]).sum(axis=(1, 2))
+    return score
+
+def evaluateBatch(boards, positional=True):
+    """N scores of (N, 64) boards: the tapered material and piece-square score (the same as
+    GameState.evaluation), plus mobility and pawn structure unless positional is False"""
+    requireNumpy()
+    codes = boards.astype(np.intp) + 6
+    middlegame = MIDDLEGAME_TABLE[codes, SQUARE_NUMBERS].sum(axis=1)
+    endgame = ENDGAME_TABLE[codes, SQUARE_NUMBERS].sum(axis=1)
+    phase = np.minimum(PHASE_TABLE[codes].sum(axis=1), MAX_PHASE)
+    scores = (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+    if positional:
+        squares = boards.reshape(-1, 8, 8)
+        scores += MOBILITY_WEIGHT * (mobility(squares, 1) - mobility(squares, -1)) + pawnStructure(squares)
+    return scores
+
+def evaluateStates(states, positional=True):
+    return evaluateBatch(packPositions(states), positional)
+
+def evaluateChildren(gs, moves, positional=True):
+    """Scores of the positions after each of moves, evaluated together"""
+    requireNumpy()
+    boards = np.empty((len(moves), 64), dtype=np.int8)
+    for i, move in enumerate(moves):
+        gs.makeMove(move)
+        boards[i] = SIGNED_CODES[np.frombuffer(gs.mailbox, dtype=np.uint8)[BOARD_INDEX]]
+        gs.undoMove()
+    return evaluateBatch(boards, positional)
+
+def randomPositions(count, seed=0, maxPlies=60):
+    """Positions from random games, for timing"""
+    rng = random.Random(seed)
+    states = []
+    while len(states) < count:
+        gs = GameState()
+        for _ in range(rng.randrange(maxPlies)):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(rng.choice(moves))
+        states.append(gs)
+    return states
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy batch evaluation")
+    parser.add_argument("--random", type=int, default=2000, help="number of random positions to time")
+    parser.add_argument("--fens", help="file of FENs to score instead, one per line")
+    args = parser.parse_args()
+    requireNumpy()
+
+    if args.fens:
+        with open(args.fens) as f:
+            fens = [line.strip() for line in f if line.strip()]
+        for fen, score in zip(fens, evaluateStates([GameState(fen) for fen in fens])):
+            print(f"{score:6} {fen}")
+        return
+
+    states = randomPositions(args.random)
+    start = time.perf_counter()
+    scalar = [gs.evaluation() for gs in states]
+    scalarTime = time.perf_counter() - start
+    start = time.perf_counter()
+    boards = packPositions(states)
+    packTime = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = evaluateBatch(boards, positional=False)
+    batchTime = time.perf_counter() - start
+    start = time.perf_counter()
+    evaluateBatch(boards)
+    positionalTime = time.perf_counter() - start
+    mismatches = sum(1 for a, b in zip(scalar, batch) if a != b)
+    print(f"{len(states)} positions, {mismatches} differ from GameState.evaluation")
+    print(f"GameState.evaluation      {scalarTime * 1e6 / len(states):8.2f} us per position")
+    print(f"pack                      {packTime * 1e6 / len(states):8.2f} us per position")
+    print(f"batch material/PST        {batchTime * 1e6 / len(states):8.2f} us per position")
+    print(f"batch with mobility/pawns {positionalTime * 1e6 / len(states):8.2f} us per position")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Fixed-depth search benchmark for computer.SearchEngine: nodes, time and move ordering quality.
+
+    python bench.py                          # depth 4 on the reference positions
+    python bench.py --depth 5 --no-killers   # the same with a search feature switched off
+    python bench.py --match --no-lmr         # play all features against the engine without the switched off ones
+    python bench.py --speedup 4              # root-split search on 4 processes against the single process search
+    python bench.py --stats search.jsonl     # also profile where the time goes, one JSON line per search
+"""
+import argparse
+import random
+import time
+import computer
+from engine import GameState
+from perft import SUITE
+from searchstats import SearchProfiler, CATEGORIES
+
+BENCH_POSITIONS = [(name, fen) for name, fen, expected in SUITE[:6]]  # The middlegame perft positions
+
+# --no-<feature> switches and the SearchEngine option each one clears
+FEATURES = {"killers": "killerMoves", "history": "historyHeuristic", "delta": "deltaPruning",
+            "null-move": "nullMovePruning", "lmr": "lateMoveReductions", "pvs": "principalVariationSearch",
+            "pawn-structure": "pawnStructure"}
+
+def makeEngine(disabled=()):
+    return computer.SearchEngine(**{FEATURES[feature]: False for feature in disabled})
+
+def resetSearch(engine):
+    """Forgets everything earlier searches learned, so each position is searched the same way every run"""
+    random.seed(0)
+    engine.clear()
+
+def runBench(depth, workers=1, disabled=()):
+    """Searches every bench position to depth; returns {name: search info plus the move played}"""
+    results = {}
+    engine = makeEngine(disabled)
+    if workers > 1:  # Start the worker processes outside the timings
+        gs = GameState()
+        engine.searchParallel(gs, gs.getValidMoves(), workers, maxDepth=1)
+    for name, fen in BENCH_POSITIONS:
+        resetSearch(engine)
+        gs = GameState(fen)
+        start = time.perf_counter()
+        if workers > 1:
+            result = engine.searchParallel(gs, gs.getValidMoves(), workers, None, None, depth, fresh=True)
+        else:
+            result = engine.search(gs, gs.getValidMoves(), timeLimit=None, maxDepth=depth, workers=1, book=False)
+        info = dict(result.info, move=result.move.getChessNotation(), seconds=time.perf_counter() - start)
+        results[name] = info
+    return results
+
+def playMatch(depth, disabled, maxPlies=120):
+    """Plays each bench position twice, the full engine taking white then black against the engine with the disabled
+    features switched off. Games still going after maxPlies are draws. Returns the full engine's (wins, draws, losses)."""
+    wins = draws = losses = 0
+    fullEngine, reducedEngine = makeEngine(), makeEngine(disabled)  # Each with its own tables
+    for name, fen in BENCH_POSITIONS:
+        for fullEngineWhite in (True, False):
+            resetSearch(fullEngine)
+            resetSearch(reducedEngine)
+            gs = GameState(fen)
+            validMoves = gs.getValidMoves()
+            while validMoves and not gs.stalemate and len(gs.moveLog) < maxPlies:
+                engine = fullEngine if gs.whiteToMove == fullEngineWhite else reducedEngine
+                gs.makeMove(engine.search(gs, validMoves, timeLimit=None, maxDepth=depth, workers=1, book=False).move)
+                validMoves = gs.getValidMoves()
+            if not gs.checkmate:
+                result = "draw"
+                draws += 1
+            elif gs.whiteToMove != fullEngineWhite:  # The side to move is mated
+                result = "win"
+                wins += 1
+            else:
+                result = "loss"
+                losses += 1
+            print(f"{name:40} full engine {'white' if fullEngineWhite else 'black'}: "
+                  f"{result} after {len(gs.moveLog)} plies")
+    return wins, draws, losses
+
+def printProfile(records):
+    """Branching, TT and quiescence figures per search and the share of the time spent in each part of the search"""
+    for record in records:
+        print(f"{record['fen'][:40]:40} ebf {record['ebf']:5.2f}  TT hits {record['ttHitRate']:6.1%}  "
+              f"pawn hash hits {record['pawnHitRate']:6.1%}  "
+              f"quiescence {record['quiescenceNodes'] / max(record['nodes'], 1):6.1%} of nodes  "
+              f"{record['nps']:>7} nodes/s")
+    seconds = sum(record["seconds"] for record in records)
+    split = {category: sum(record["time"][category] * record["seconds"] for record in records) / seconds
+             for category in CATEGORIES} if seconds else {}
+    print("time: " + "  ".join(f"{category} {share:.1%}" for category, share in split.items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Fixed-depth search benchmark")
+    parser.add_argument("--depth", type=int, default=4)
+    for feature, option in FEATURES.items():
+        parser.add_argument("--no-" + feature, action="store_true", help=f"search with SearchEngine({option}=False)")
+    parser.add_argument("--match", action="store_true",
+                        help="play the full engine against one with the --no-<feature> switches applied")
+    parser.add_argument("--speedup", type=int, metavar="WORKERS",
+                        help="time the root-split search on WORKERS processes against the single process search")
+    parser.add_argument("--stats", metavar="FILE", help="profile the searches, writing one JSON line per search to FILE")
+    args = parser.parse_args()
+    disabled = [feature for feature in FEATURES if getattr(args, "no_" + feature.replace("-", "_"))]
+
+    if args.match:
+        wins, draws, losses = playMatch(args.depth, disabled)
+        print(f"full engine vs --no-{' --no-'.join(disabled) or '(nothing)'}: +{wins} ={draws} -{losses}")
+        return
+
+    if args.speedup:
+        single, parallel = runBench(args.depth, 1, disabled), runBench(args.depth, args.speedup, disabled)
+        singleTime = sum(info["seconds"] for info in single.values())
+        parallelTime = sum(info["seconds"] for info in parallel.values())
+        for name in single:
+            print(f"{name:40} 1 worker {single[name]['seconds']:7.2f}s {single[name]['move']:6}  "
+                  f"{args.speedup} workers {parallel[name]['seconds']:7.2f}s {parallel[name]['move']:6}  "
+                  f"x{single[name]['seconds'] / parallel[name]['seconds']:.2f}")
+        print(f"{'total':40} 1 worker {singleTime:7.2f}s         {args.speedup} workers {parallelTime:7.2f}s"
+              f"         x{singleTime / parallelTime:.2f}")
+        return
+
+    profiler = SearchProfiler(args.stats) if args.stats else None
+    if profiler:
+        profiler.enable()
+    results = runBench(args.depth, 1, disabled)
+    if profiler:
+        profiler.disable()
+    totalNodes, totalTime, totalCutoffs, totalFirst = 0, 0.0, 0, 0
+    for name, info in results.items():
+        print(f"{name:40} {info['move']:6} {info['nodes']:>9} nodes  first move cutoffs "
+              f"{info['firstMoveCutoffRate']:6.1%}  {info['seconds']:7.2f}s")
+        totalNodes += info["nodes"]
+        totalTime += info["seconds"]
+        totalCutoffs += info["cutoffs"]
+        totalFirst += round(info["firstMoveCutoffRate"] * info["cutoffs"])
+    print(f"{'total':40} {'':6} {totalNodes:>9} nodes  first move cutoffs "
+          f"{totalFirst / totalCutoffs if totalCutoffs else 0:6.1%}  {totalTime:7.2f}s")
+    if profiler:
+        printProfile(profiler.records)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Opening book: a sorted binary file of (position key, move, weight) entries, memory-mapped and binary searched.
+
+    python book.py build games.pgn more.pgn --out book.bin --plies 20   # build from PGN game collections
+    python book.py probe --book book.bin --fen "<fen>"                 # list the book moves of a position
+
+Entries use the Polyglot layout: 16 bytes, big-endian key (8), move (2), weight (2) and learn (4), sorted by key,
+with Polyglot's move encoding. The keys are GameState.zobristKey rather than Polyglot's own random numbers, so
+books built here only work with this engine, and Polyglot books from elsewhere don't match any position.
+"""
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+from engine import GameState
+from moves import Move, PIECE_TYPE, PIECE_CODES, KNIGHT, BISHOP, ROOK, QUEEN
+
+ENTRY = struct.Struct(">QHHI")  # key, move, weight, learn
+KEY = struct.Struct(">Q")
+PROMOTION_CODES = {KNIGHT: 1, BISHOP: 2, ROOK: 3, QUEEN: 4}  # Polyglot promotion field by piece type
+MAX_WEIGHT = 0xFFFF
+
+def encodeMove(move):
+    """Polyglot move bits: to file, to rank, from file, from rank (3 bits each, rank 0 is the first rank), promotion.
+    Castling is written as the king taking its own rook."""
+    endCol = move.endCol
+    if move.isCastleMove:
+        endCol = 7 if endCol == 6 else 0
+    return endCol | (7 - move.endRow) << 3 | move.startCol << 6 | (7 - move.startRow) << 9 | \
+        PROMOTION_CODES.get(move.promotion, 0) << 12
+
+class OpeningBook:
+    """Lookups read the memory-mapped file in place: nothing is parsed when it is opened, and a probe is a binary
+    search touching a handful of entries"""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.entries = os.fstat(self.file.fileno()).st_size // ENTRY.size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.entries else b""
+
+    def close(self):
+        if self.entries:
+            self.map.close()
+        self.file.close()
+
+    def lookup(self, key):
+        """Returns [(Polyglot move bits, weight)] stored for the position key"""
+        low, high = 0, self.entries
+        while low < high:  # First entry with a key >= key
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.map, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < self.entries:
+            entryKey, moveBits, weight, learn = ENTRY.unpack_from(self.map, low * ENTRY.size)
+            if entryKey != key:
+                break
+            found.append((moveBits, weight))
+            low += 1
+        return found
+
+    def bookMoves(self, gs, validMoves):
+        """[(move, weight)] of the book entries for gs that are among validMoves"""
+        entries = self.lookup(gs.zobristKey)
+        if not entries:
+            return []
+        byBits = {encodeMove(move): move for move in validMoves}
+        return [(byBits[moveBits], weight) for moveBits, weight in entries if moveBits in byBits and weight]
+
+    def chooseMove(self, gs, validMoves):
+        """A book move picked at random in proportion to its weight, None once the game has left the book"""
+        moves = self.bookMoves(gs, validMoves)
+        if not moves:
+            return None
+        return random.choices([move for move, weight in moves], [weight for move, weight in moves])[0]
+
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+def parseSan(gs, san, validMoves):
+    """The move of validMoves written as san (e.g. "Nbd7", "exd8=Q+", "O-O"), None if there is none"""
+    san = san.rstrip("+#!?")
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endCol = 6 if len(san) == 3 else 2
+        for move in validMoves:
+            if move.isCastleMove and move.endCol == endCol:
+                return move
+        return None
+    match = SAN_PATTERN.match(san)
+    if match is None:
+        return None
+    pieceName, fromFile, fromRank, target, promotion = match.groups()
+    pieceType = PIECE_CODES["w" + (pieceName or "p")] & PIECE_TYPE
+    endRow, endCol = Move.ranksToRows[target[1]], Move.filesToCols[target[0]]
+    promotionType = PIECE_CODES["w" + promotion] & PIECE_TYPE if promotion else 0
+    for move in validMoves:
+        if move.endRow == endRow and move.endCol == endCol and gs.mailbox[move.startSq] & PIECE_TYPE == pieceType \
+                and move.promotion == promotionType and not move.isCastleMove \
+                and (fromFile is None or move.startCol == Move.filesToCols[fromFile]) \
+                and (fromRank is None or move.startRow == Move.ranksToRows[fromRank]):
+            return move
+    return None
+
+RESULTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1), "*": (1, 1)}  # (white, black) points
+
+def readGames(path):
+    """Yields (result, [SAN moves]) for every game of a PGN file that starts from the initial position"""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    for game in re.split(r"\n\s*\n(?=\[)", text):
+        tags = dict(re.findall(r'^\[(\w+)\s+"(.*)"\]\s*$', game, re.MULTILINE))
+        if "FEN" in tags:
+            continue  # Starts from a set-up position
+        movetext = re.sub(r"^\[.*\]\s*$", "", game, flags=re.MULTILINE)
+        movetext = re.sub(r"\{[^}]*\}|;[^\n]*|\$\d+", " ", movetext)
+        while "(" in movetext:  # Variations, innermost first
+            movetext = re.sub(r"\([^()]*\)", " ", movetext)
+        tokens = re.sub(r"\d+\.(\.\.)?", " ", movetext).split()
+        result = tags.get("Result", "*")
+        if tokens and tokens[-1] in RESULTS:
+            result = tokens.pop()
+        yield result, tokens
+
+def buildBook(pgnPaths, outPath, plies=20, minGames=1):
+    """Adds up, for the first plies moves of every game, 2 points to a move for a win of the side that played it and
+    1 for a draw. Moves played in fewer than minGames games or that never scored are left out. Returns the number of
+    games read and entries written."""
+    stats = {}  # (key, move bits) -> [games, points]
+    games = 0
+    for path in pgnPaths:
+        for result, sanMoves in readGames(path):
+            games += 1
+            points = RESULTS.get(result, (1, 1))
+            gs = GameState()
+            for san in sanMoves[:plies]:
+                move = parseSan(gs, san, gs.getValidMoves())
+                if move is None:
+                    break  # Not legal here, the rest of the game can't be followed
+                entry = stats.setdefault((gs.zobristKey, encodeMove(move)), [0, 0])
+                entry[0] += 1
+                entry[1] += points[0 if gs.whiteToMove else 1]
+                gs.makeMove(move)
+    kept = [(key, moveBits, points) for (key, moveBits), (count, points) in stats.items()
+            if count >= minGames and points]
+    scale = min(1.0, MAX_WEIGHT / max((points for key, moveBits, points in kept), default=1))
+    with open(outPath, "wb") as f:
+        for key, moveBits, points in sorted(kept):
+            f.write(ENTRY.pack(key, moveBits, max(1, round(points * scale)), 0))
+    return games, len(kept)
+
+def main():
+    parser = argparse.ArgumentParser(description="Opening book builder and viewer")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("pgn", nargs="+")
+    build.add_argument("--out", default="book.bin")
+    build.add_argument("--plies", type=int, default=20, help="moves of each game that go into the book")
+    build.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("--book", default="book.bin")
+    probe.add_argument("--fen", help="position to look up (default: start position)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        games, entries = buildBook(args.pgn, args.out, args.plies, args.min_games)
+        print(f"{games} games, {entries} entries written to {args.out}")
+        return
+
+    gs = GameState(args.fen) if args.fen else GameState()
+    book = OpeningBook(args.book)
+    moves = book.bookMoves(gs, gs.getValidMoves())
+    total = sum(weight for move, weight in moves)
+    for move, weight in sorted(moves, key=lambda item: -item[1]):
+        print(f"{move.getChessNotation():6} {weight:6} {weight / total:6.1%}")
+    if not moves:
+        print("not in book")
+    book.close()
+
+if __name__ == "__main__":
+    main()
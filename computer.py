@@ -1,9 +1,46 @@
+import os
 import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from engine import GameState
+from moves import Move, SQUARES_MASK, BOARD_SQUARES, PIECE_TYPE, EMPTY, WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from evaluation import PIECE_VALUES
+from transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+from pawns import PawnHashTable
+from book import OpeningBook
+from tablebase import Tablebase, TABLEBASE_DIR, MAX_PIECES, LOSS
 
-pieceScore = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
-CHECKMATE = 1000
+pieceScore = {KING: 0, QUEEN: 9, ROOK: 5, BISHOP: 3, KNIGHT: 3, PAWN: 1}
+CHECKMATE = 100000
 STALEMATE = 0
-DEPTH = 3
+MAX_DEPTH = 30  # Iterative deepening stops here even with time left
+TIME_LIMIT = 2.0  # Seconds the hard level may think per move
+NODE_CHECK_INTERVAL = 1024  # Nodes between clock reads
+DELTA_PRUNING = True  # Quiescence skips captures that can't lift the score near alpha even if nothing recaptures
+DELTA_MARGIN = 200
+KILLER_MOVES = True  # Try the quiet moves that last cut off at the same ply first
+HISTORY_HEURISTIC = True  # Then the quiet moves by how often their from/to squares cut off
+NULL_MOVE_PRUNING = True  # If passing still fails high, a real move will too, so search the pass shallower
+NULL_MOVE_REDUCTION = 2
+LATE_MOVE_REDUCTIONS = True  # Quiet moves ordered late rarely matter, search them a ply shallower first
+LATE_MOVE_START = 3  # Moves searched at full depth before reducing
+PRINCIPAL_VARIATION_SEARCH = True  # After the first move only prove the others are worse, with a null window
+MAX_PLY = 128
+MATE_BOUND = CHECKMATE - MAX_PLY  # Scores past this are mates: CHECKMATE less the plies to mate from the root
+CUTOFF_BUCKETS = 8  # Beta cutoffs are counted by the move that made them: 1st, 2nd ... 8th or later
+TT_SIZE_MB = 16
+PAWN_STRUCTURE = True  # Score doubled, isolated and passed pawns, cached in a pawn hash table
+PAWN_HASH_SIZE_KB = 256
+WORKERS = 1  # Processes for the hard level; more than 1 splits the root moves between them
+BOOK_FILE = "book.bin"  # Opening book built by book.py; the hard level plays from it while the game is in it
+TABLEBASES = True  # Probe the endgame tables generated by tablebase.py at the root and in the search
+TABLEBASE_WIN = CHECKMATE - 1000  # Score of a tablebase win, less the plies to mate so the quicker mate scores higher
+TABLEBASE_BOUND = TABLEBASE_WIN - 2 * MAX_PLY  # Scores past this are tablebase wins or mates, counted from the root
+workerPool, workerPoolSize = None, 0  # Process pool of the parallel search, shared by every SearchEngine
+workerEngine = None  # SearchEngine of a worker process, kept so the worker keeps its tables between moves
+openingBook = None  # OpeningBook of BOOK_FILE, opened on first use
+tablebase = Tablebase(TABLEBASE_DIR)  # Tables are opened when a position with their material is first probed
 def findRandomMove(validMoves):
     return random.choice(validMoves)
 
@@ -23,7 +60,7 @@ def findBestMove(gs, validMoves): #MinMAx Algorithm
             elif gs.stalemate:
                 score = STALEMATE
             else:
-                score = -turnMultiplier * scoreMaterial(gs.board)
+                score = -turnMultiplier * scoreMaterial(gs.mailbox)
             if score > opponentMaxScore:
                 opponentMaxScore = score
             gs.undoMove()
@@ -33,33 +70,446 @@ def findBestMove(gs, validMoves): #MinMAx Algorithm
         gs.undoMove()
     return bestPlayerMove
 
-def findBestMoveAlphaBeta(gs, validMoves): #AlphaBeta Algorithm
-    global nextMove
-    nextMove = None
-    random.shuffle(validMoves)
-    alphaBeta(gs, validMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    return nextMove
-
-def alphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove
-    if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
-    maxScore = -CHECKMATE
-    for move in validMoves:
-        gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
-        score = -alphaBeta(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier)
-        if score > maxScore:
-            maxScore = score
-            if depth == DEPTH:
-                nextMove = move
-        gs.undoMove()
-        alpha = max(alpha, maxScore)
-        if alpha >= beta:
-            break
-    return maxScore
 
-def scoreBoard(gs):
+class SearchResult:
+    """What a search found: the move to play, its score for the side to move, the principal variation, the deepest
+    completed depth and the nodes searched. info has the rest of the last iteration's statistics."""
+
+    def __init__(self, move, info):
+        self.move = move
+        self.score, self.pv, self.depth, self.nodes = info["score"], info["pv"], info["depth"], info["nodes"]
+        self.info = info
+
+class SearchEngine:
+    """The hard level's search. Each engine has its own options, transposition table, move ordering tables,
+    statistics and stop flag, so several can search at once (two computer players, pondering, games in other
+    threads). One engine runs one search at a time; stop, ponderHit and progress may be called from other threads.
+    The opening book, the tablebases and the parallel search's worker processes are shared between engines."""
+
+    def __init__(self, ttSizeMB=TT_SIZE_MB, killerMoves=KILLER_MOVES, historyHeuristic=HISTORY_HEURISTIC,
+                 deltaPruning=DELTA_PRUNING, nullMovePruning=NULL_MOVE_PRUNING, lateMoveReductions=LATE_MOVE_REDUCTIONS,
+                 principalVariationSearch=PRINCIPAL_VARIATION_SEARCH, tablebases=TABLEBASES,
+                 pawnStructure=PAWN_STRUCTURE, pawnHashSizeKB=PAWN_HASH_SIZE_KB):
+        self.ttSizeMB = ttSizeMB
+        self.killerMoves = killerMoves
+        self.historyHeuristic = historyHeuristic
+        self.deltaPruning = deltaPruning
+        self.nullMovePruning = nullMovePruning
+        self.lateMoveReductions = lateMoveReductions
+        self.principalVariationSearch = principalVariationSearch
+        self.tablebases = tablebases
+        self.pawnStructure = pawnStructure
+        self.pawnHashSizeKB = pawnHashSizeKB
+        self.transpositionTable = TranspositionTable(ttSizeMB)  # Kept between moves, so each search reuses the last
+        self.pawnTable = PawnHashTable(pawnHashSizeKB)
+        self.killers = [[None, None] for _ in range(MAX_PLY)]  # Two quiet cutoff moves per ply
+        self.historyTable = [0] * (SQUARES_MASK + 1)  # Indexed by move.moveID & SQUARES_MASK
+        self.cutoffHistogram = [0] * CUTOFF_BUCKETS  # Beta cutoffs of the running search by moves searched
+        self.info = {}  # depth, score (for the side to move), nodes, cutoff and TT hit rates, ebf, nps, seconds and
+                        # pv of the last iteration
+        self.iterations = []  # (depth, score, moveID) of every completed iteration of the last search
+        self.nodes, self.nodeLimit, self.stopped, self.startTime, self.deadline = 0, None, False, 0.0, None
+        self.rootMove = None  # Best root move of the running iteration
+        self.searching = threading.Event()  # Set while the iterative deepening runs, from its clock start
+
+    def options(self):
+        """The constructor arguments, to make an engine that searches the same way"""
+        return {"ttSizeMB": self.ttSizeMB, "killerMoves": self.killerMoves, "historyHeuristic": self.historyHeuristic,
+                "deltaPruning": self.deltaPruning, "nullMovePruning": self.nullMovePruning,
+                "lateMoveReductions": self.lateMoveReductions,
+                "principalVariationSearch": self.principalVariationSearch, "tablebases": self.tablebases,
+                "pawnStructure": self.pawnStructure, "pawnHashSizeKB": self.pawnHashSizeKB}
+
+    def clear(self):
+        """Forgets everything earlier searches learned"""
+        self.transpositionTable.clear()
+        self.pawnTable.clear()
+        for i in range(len(self.historyTable)):
+            self.historyTable[i] = 0
+
+    def search(self, gs, validMoves, timeLimit=TIME_LIMIT, nodeLimit=None, maxDepth=MAX_DEPTH, workers=WORKERS,
+               book=True, tablebases=True):
+        """Iterative deepening AlphaBeta: searches depth 1, 2, 3... until timeLimit seconds or nodeLimit nodes run
+        out (None for no limit) and returns the SearchResult of the deepest fully searched depth. Each iteration
+        starts with the previous one's best move, and the transposition table gives the rest of its principal
+        variation first. With more than one worker the root moves are split between that many processes, see
+        searchParallel. Positions in the opening book are answered from it without searching unless book is False,
+        and positions in the endgame tablebases likewise unless tablebases (or the engine's tablebases option) is
+        False; the option alone decides whether the search probes them below the root. With no valid moves (the
+        game is over) the result's move is None."""
+        if not validMoves:
+            return self.gameOverResult(gs)
+        bookMove = findBookMove(gs, validMoves) if book else None
+        if bookMove is not None:
+            self.iterations.clear()
+            self.info = {"depth": 0, "score": 0, "nodes": 0, "cutoffs": 0, "firstMoveCutoffRate": 0.0,
+                         "seconds": 0.0, "pv": [bookMove], "book": True}
+            return SearchResult(bookMove, self.info)
+        tablebaseMove = self.findTablebaseMove(gs, validMoves) if tablebases else None
+        if tablebaseMove is not None:
+            return SearchResult(tablebaseMove, self.info)
+        if workers > 1 and len(validMoves) > 1:
+            return self.searchParallel(gs, validMoves, workers, timeLimit, nodeLimit, maxDepth)
+        random.shuffle(validMoves)  # Equal moves still vary from game to game
+        validMoves.sort(key=gs.moveOrderValue, reverse=True)
+        self.transpositionTable.newSearch()
+        for killers in self.killers:
+            killers[0] = killers[1] = None
+        for i in range(len(self.historyTable)):
+            self.historyTable[i] >>= 1  # Older searches count less
+        entry = self.transpositionTable.probe(gs.zobristKey)
+        if entry is not None:  # Search the remembered best move first
+            moveToFront(validMoves, Move.fromID(entry[3]))
+        startTime = time.perf_counter()
+        self.deadline = startTime + timeLimit if timeLimit is not None else None
+        self.startTime = startTime  # After the deadline, which ponderHit may replace once searching is set
+        self.nodeLimit, self.nodes, self.stopped = nodeLimit, 0, False
+        self.cutoffHistogram[:] = [0] * CUTOFF_BUCKETS
+        ttProbes, ttHits = self.transpositionTable.probes, self.transpositionTable.hits
+        pawnProbes, pawnHits = self.pawnTable.probes, self.pawnTable.hits
+        self.info = {"depth": 0, "score": 0, "nodes": 0, "cutoffs": 0, "firstMoveCutoffRate": 0.0, "seconds": 0.0,
+                     "pv": []}
+        self.iterations.clear()
+        iterationNodes = [0]  # Nodes searched by the end of each iteration
+        bestMove = validMoves[0] if validMoves else None
+        self.searching.set()
+        try:
+            for depth in range(1, maxDepth + 1):
+                self.rootMove = None
+                score = self.alphaBeta(gs, validMoves, depth, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
+                if self.stopped:
+                    break  # The unfinished depth may not have looked at the better moves yet, keep the last full result
+                bestMove = self.rootMove
+                moveToFront(validMoves, bestMove)
+                self.iterations.append((depth, score, bestMove.moveID))
+                iterationNodes.append(self.nodes)
+                seconds = time.perf_counter() - startTime
+                cutoffs = sum(self.cutoffHistogram)
+                probes = self.transpositionTable.probes - ttProbes
+                pawnLookups, pawnLookupHits = self.pawnTable.probes - pawnProbes, self.pawnTable.hits - pawnHits
+                lastIteration = iterationNodes[-1] - iterationNodes[-2]
+                previousIteration = iterationNodes[-2] - iterationNodes[-3] if depth > 1 else 0
+                self.info = {"depth": depth, "score": score, "nodes": self.nodes, "cutoffs": cutoffs,
+                             "firstMoveCutoffRate": round(self.cutoffHistogram[0] / cutoffs, 3) if cutoffs else 0.0,
+                             "cutoffHistogram": list(self.cutoffHistogram),
+                             "ttHitRate": round((self.transpositionTable.hits - ttHits) / probes, 3) if probes else 0.0,
+                             "pawnHitRate": round(pawnLookupHits / pawnLookups, 3) if pawnLookups else 0.0,
+                             # Effective branching factor: how many times more nodes this iteration took than the last
+                             "ebf": round(lastIteration / previousIteration, 2) if previousIteration else 0.0,
+                             "nps": round(self.nodes / seconds) if seconds > 0 else 0,
+                             "seconds": round(seconds, 3), "pv": self.principalVariation(gs, depth)}
+                if abs(score) >= MATE_BOUND:
+                    break  # Found a forced mate, its score says in how many plies
+        finally:
+            self.searching.clear()
+        if not self.iterations:  # Stopped before depth 1 was done
+            self.info = dict(self.info, nodes=self.nodes, pv=[bestMove] if bestMove is not None else [])
+        return SearchResult(bestMove, self.info)
+
+    def searchParallel(self, gs, validMoves, workers, timeLimit=TIME_LIMIT, nodeLimit=None, maxDepth=MAX_DEPTH,
+                       fresh=False):
+        """Root splitting: the ordered root moves are dealt out between worker processes, each runs the iterative
+        deepening search on its share under the same budget (nodeLimit is split), and the best move is taken from
+        the deepest depth every worker completed. fresh clears the workers' tables first, for repeatable
+        benchmarks."""
+        global workerPool, workerPoolSize
+        if not validMoves:
+            return self.gameOverResult(gs)
+        if workerPool is None or workerPoolSize != workers:
+            if workerPool is not None:
+                workerPool.shutdown()
+            workerPool, workerPoolSize = ProcessPoolExecutor(workers), workers
+        startTime = time.perf_counter()
+        random.shuffle(validMoves)
+        validMoves.sort(key=gs.moveOrderValue, reverse=True)
+        entry = self.transpositionTable.probe(gs.zobristKey)
+        if entry is not None:
+            moveToFront(validMoves, Move.fromID(entry[3]))
+        history = [move.moveID for move in gs.moveLog]
+        workerNodeLimit = nodeLimit // workers if nodeLimit is not None else None
+        jobs = [workerPool.submit(searchRootMoves, gs.startFen, history,
+                                  [move.moveID for move in validMoves[i::workers]], timeLimit, workerNodeLimit,
+                                  maxDepth, fresh, self.options())
+                for i in range(min(workers, len(validMoves)))]
+        results = [job.result() for job in jobs]  # ([(depth, score, moveID)...], nodes) per worker
+
+        # Compare the workers at the deepest depth they all finished. A worker that found its share decided (mate
+        # for or against) stopped deepening, and its last result stands at any depth.
+        finished = [iterations for iterations, nodes in results if iterations]
+        if not finished:
+            self.info = {"depth": 0, "score": 0, "nodes": sum(nodes for iterations, nodes in results),
+                         "seconds": round(time.perf_counter() - startTime, 3), "pv": [validMoves[0]],
+                         "workers": workers}
+            return SearchResult(validMoves[0], self.info)
+        undecidedDepths = [iterations[-1][0] for iterations in finished if abs(iterations[-1][1]) < MATE_BOUND]
+        depth = min(undecidedDepths) if undecidedDepths else max(iterations[-1][0] for iterations in finished)
+        best = None
+        for iterations in finished:
+            candidates = [result for result in iterations if result[0] <= depth]
+            if candidates and (best is None or candidates[-1][1] > best[1]):  # Of two mates the quicker scores higher
+                best = candidates[-1]
+        self.info = {"depth": depth, "score": best[1], "nodes": sum(nodes for iterations, nodes in results),
+                     "seconds": round(time.perf_counter() - startTime, 3), "pv": [Move.fromID(best[2])],
+                     "workers": workers}
+        return SearchResult(Move.fromID(best[2]), self.info)
+
+    def gameOverResult(self, gs):
+        """SearchResult of a position without valid moves: no move, scored as checkmate or stalemate"""
+        inCheck = gs.squareUnderAttack(gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation)
+        self.iterations.clear()
+        self.info = {"depth": 0, "score": -CHECKMATE if inCheck else STALEMATE, "nodes": 0, "cutoffs": 0,
+                     "firstMoveCutoffRate": 0.0, "seconds": 0.0, "pv": []}
+        return SearchResult(None, self.info)
+
+    def findTablebaseMove(self, gs, validMoves):
+        """The move to the quickest win, or else a draw, or else the longest defence, by the tablebases. None when
+        the position or one of its moves isn't in them."""
+        if not self.tablebases or gs.pieceCount > MAX_PIECES or tablebase.probe(gs) is None:
+            return None
+        bestMove, bestRank = None, None
+        for move in validMoves:
+            gs.makeMove(move)
+            result = tablebase.probe(gs)
+            gs.undoMove()
+            if result is None:
+                return None
+            outcome, plies = result  # For the opponent
+            rank = (-outcome, -plies if outcome == LOSS else plies)
+            if bestRank is None or rank > bestRank:
+                bestMove, bestRank = move, rank
+        if bestMove is not None:
+            outcome, plies = -bestRank[0], abs(bestRank[1])
+            self.iterations.clear()
+            self.info = {"depth": 0, "score": -outcome * (TABLEBASE_WIN - plies - 1), "nodes": 0, "cutoffs": 0,
+                         "firstMoveCutoffRate": 0.0, "seconds": 0.0, "pv": [bestMove], "tablebase": True}
+        return bestMove
+
+    def stop(self):
+        """Makes a running search return within NODE_CHECK_INTERVAL nodes, with the best move of its last completed
+        depth. Meant to be called from another thread than the search's; the parallel search's workers are not
+        stopped, they finish their time budget."""
+        self.stopped = True
+
+    def ponderHit(self, timeLimit=TIME_LIMIT, timeout=None):
+        """Turns a running search started without a time limit (pondering the opponent's expected move, which they
+        have now played) into a timed one. The time already spent counts, so a long ponder answers at once.
+        Waits up to timeout seconds (None for as long as it takes) for a search whose thread hasn't started it yet,
+        and returns whether there was one to change."""
+        if not self.searching.wait(timeout):
+            return False
+        self.deadline = self.startTime + timeLimit
+        return True
+
+    def progress(self):
+        """(deepest completed depth, nodes so far) of the running or last search, for a live display"""
+        return self.info.get("depth", 0), self.nodes
+
+    def principalVariation(self, gs, depth):
+        """Follows the transposition table's best moves from the current position"""
+        pv = []
+        for _ in range(depth):
+            entry = self.transpositionTable.probe(gs.zobristKey)
+            if entry is None:
+                break
+            move = Move.fromID(entry[3])
+            if move not in gs.getValidMoves():
+                break
+            gs.makeMove(move)
+            pv.append(move)
+        for _ in pv:
+            gs.undoMove()
+        return pv
+
+    def outOfBudget(self):
+        """Sets stopped once the node limit is reached or, every NODE_CHECK_INTERVAL nodes, the deadline passed"""
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            self.stopped = True
+        elif self.deadline is not None and self.nodes % NODE_CHECK_INTERVAL == 0 and \
+                time.perf_counter() >= self.deadline:
+            self.stopped = True
+        return self.stopped
+
+    def alphaBeta(self, gs, validMoves, depth, alpha, beta, turnMultiplier, ply=0, allowNullMove=True):
+        """validMoves is only given at the root; below it moves come lazily from gs.orderedMoves,
+        so the quiet moves of a node that cuts off on a capture are never generated.
+        Once the search is out of budget every node returns 0 at once and nothing more is stored."""
+        self.nodes += 1
+        if self.stopped or self.outOfBudget():
+            return 0
+        if validMoves is None and gs.isDraw():
+            return STALEMATE
+        if self.tablebases and validMoves is None and gs.pieceCount <= MAX_PIECES:
+            result = tablebase.probe(gs)
+            if result is not None:  # Exact, however deep the search was still meant to go
+                outcome, plies = result
+                return outcome * (TABLEBASE_WIN - ply - plies)  # Counted from the root, like mates
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, turnMultiplier, ply)
+        hashMove = None
+        transpositionTable = self.transpositionTable
+        if validMoves is None:
+            entry = transpositionTable.probe(gs.zobristKey)
+            if entry is not None:
+                entryDepth, bound, score, moveID = entry
+                score = scoreFromTable(score, ply)
+                if entryDepth >= depth:  # Searched at least as deep before: may settle this node without searching
+                    if bound == EXACT:
+                        return score
+                    elif bound == LOWER_BOUND:
+                        alpha = max(alpha, score)
+                    else:
+                        beta = min(beta, score)
+                    if alpha >= beta:
+                        return score
+                if moveID:
+                    hashMove = Move.fromID(moveID)
+        alphaStart = alpha  # After the table's bounds narrowed the window, so the stored bound is of this window
+        inCheck = gs.squareUnderAttack(gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation)
+
+        # Null move: give the opponent a free move; if we still beat beta, this node fails high anyway.
+        # Not in check (passing would be illegal) and not with only pawns, where passing may beat every move (zugzwang)
+        if self.nullMovePruning and allowNullMove and validMoves is None and not inCheck and \
+                depth > NULL_MOVE_REDUCTION and abs(beta) < MATE_BOUND and gs.hasNonPawnMaterial():
+            gs.makeNullMove()
+            score = -self.alphaBeta(gs, None, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1, -turnMultiplier,
+                                    ply + 1, allowNullMove=False)
+            gs.undoNullMove()
+            if self.stopped:
+                return 0
+            if score >= beta:
+                return beta
+
+        maxScore = -CHECKMATE
+        bestMove = None
+        killers = self.killers[ply] if self.killerMoves and ply < MAX_PLY else ()
+        history = self.historyTable if self.historyHeuristic else None
+        moves = validMoves if validMoves is not None else gs.orderedMoves(hashMove, killers=killers, history=history)
+        movesSearched = 0
+        for move in moves:
+            quiet = gs.capturedPiece(move) == EMPTY and not move.isPawnPromotion
+            gs.makeMove(move)
+            if movesSearched == 0:
+                score = -self.alphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier, ply + 1)
+            else:
+                reduction = 0
+                if self.lateMoveReductions and quiet and movesSearched >= LATE_MOVE_START and depth >= 3 and \
+                        not inCheck and move not in killers and \
+                        not gs.squareUnderAttack(gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation):
+                    reduction = 1  # A quiet, non-checking move late in the order
+                if self.principalVariationSearch or reduction:
+                    score = -self.alphaBeta(gs, None, depth - 1 - reduction, -alpha - 1, -alpha, -turnMultiplier,
+                                            ply + 1)
+                    if reduction and score > alpha:  # The reduced search says it might be better, verify at full depth
+                        score = -self.alphaBeta(gs, None, depth - 1, -alpha - 1, -alpha, -turnMultiplier, ply + 1)
+                    if alpha < score < beta:  # Better than the best so far: get its exact score
+                        score = -self.alphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier, ply + 1)
+                else:
+                    score = -self.alphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier, ply + 1)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            movesSearched += 1
+            if score > maxScore or bestMove is None:
+                maxScore = score
+                bestMove = move
+                if validMoves is not None:
+                    self.rootMove = move
+            alpha = max(alpha, maxScore)
+            if alpha >= beta:
+                self.cutoffHistogram[min(movesSearched, CUTOFF_BUCKETS) - 1] += 1
+                if quiet:  # Captures are already ordered well, remember the quiet moves that refute
+                    if killers and killers[0] != move:
+                        killers[1], killers[0] = killers[0], move
+                    self.historyTable[move.moveID & SQUARES_MASK] += depth * depth
+                break
+        if bestMove is None:  # No legal moves
+            return -CHECKMATE + ply if inCheck else STALEMATE  # The further away the mate, the less it scores
+        if maxScore <= alphaStart:
+            bound = UPPER_BOUND
+        elif maxScore >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        transpositionTable.store(gs.zobristKey, depth, bound, scoreToTable(maxScore, ply), bestMove.moveID)
+        return maxScore
+
+    def quiescence(self, gs, alpha, beta, turnMultiplier, ply):
+        """Searches captures and promotions (every evasion when in check) until the position is quiet, so the leaves
+        are not scored in the middle of an exchange. The side to move may stand pat on the static score instead."""
+        self.nodes += 1
+        if self.stopped or self.outOfBudget():
+            return 0
+        inCheck = gs.squareUnderAttack(gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation)
+        standPat = -CHECKMATE + ply  # Kept if no evasion is found: mated here
+        if not inCheck:  # In check every evasion has to be searched, there is no standing pat
+            standPat = turnMultiplier * scoreBoard(gs, self.pawnTable if self.pawnStructure else None)
+            if standPat >= beta:
+                return standPat
+            alpha = max(alpha, standPat)
+        maxScore = standPat
+        for move in gs.orderedMoves(capturesOnly=True):  # MVV-LVA order
+            if self.deltaPruning and not inCheck and not move.isPawnPromotion and \
+                    standPat + PIECE_VALUES[gs.capturedPiece(move) & PIECE_TYPE][0] + DELTA_MARGIN < alpha:
+                continue
+            gs.makeMove(move)
+            score = -self.quiescence(gs, -beta, -alpha, -turnMultiplier, ply + 1)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            if score > maxScore:
+                maxScore = score
+                if score >= beta:
+                    break
+                alpha = max(alpha, score)
+        return maxScore
+
+def searchRootMoves(fen, history, rootMoveIDs, timeLimit, nodeLimit, maxDepth, fresh, options):
+    """Worker process side of SearchEngine.searchParallel: replays the game and searches only the given root moves"""
+    global workerEngine
+    if workerEngine is None or workerEngine.options() != options:
+        workerEngine = SearchEngine(**options)
+    gs = GameState(fen)
+    for moveID in history:
+        gs.makeMove(Move.fromID(moveID))
+    if fresh:
+        workerEngine.clear()
+    # The caller has already looked the root up in the book and tablebases; a worker's share of the root moves
+    # must be searched, its tablebase positions below the root are still probed
+    result = workerEngine.search(gs, [Move.fromID(moveID) for moveID in rootMoveIDs], timeLimit, nodeLimit, maxDepth,
+                                 workers=1, book=False, tablebases=False)
+    return list(workerEngine.iterations), result.nodes
+
+def findBookMove(gs, validMoves):
+    """A weighted random book move for the position, None without a book or out of it"""
+    global openingBook
+    if openingBook is None and BOOK_FILE and os.path.exists(BOOK_FILE):
+        openingBook = OpeningBook(BOOK_FILE)
+    return openingBook.chooseMove(gs, validMoves) if openingBook is not None else None
+
+def scoreToTable(score, ply):
+    """Mate and tablebase scores count plies from the root; the transposition table keeps them counted from the
+    stored node, so they stay right when the position comes up at another ply or in a later search"""
+    if score >= TABLEBASE_BOUND:
+        return score + ply
+    if score <= -TABLEBASE_BOUND:
+        return score - ply
+    return score
+
+def scoreFromTable(score, ply):
+    if score >= TABLEBASE_BOUND:
+        return score - ply
+    if score <= -TABLEBASE_BOUND:
+        return score + ply
+    return score
+
+def moveToFront(moves, move):
+    if move in moves:
+        moves.remove(move)
+        moves.insert(0, move)
+
+
+def scoreBoard(gs, pawnTable=None):
+    """Static score for white; the pawn structure terms are added when a PawnHashTable is given"""
     if gs.checkmate:
         if gs.whiteToMove:
             return -CHECKMATE
@@ -67,15 +517,16 @@ def scoreBoard(gs):
             return CHECKMATE
     elif gs.stalemate:
         return STALEMATE
-    score = scoreMaterial(gs.board)
-    return score
+    if pawnTable is not None:
+        return gs.evaluation() + pawnTable.score(gs)
+    return gs.evaluation()  # Kept up to date by makeMove / undoMove
 
 def scoreMaterial(board):
+    """board is the GameState mailbox"""
     score = 0
-    for row in board:
-        for square in row:
-            if square[0] == 'w':
-                score += pieceScore[square[1]]
-            elif square[0] == 'b':
-                score -= pieceScore[square[1]]
-    return score
\ No newline at end of file
+    for sq in BOARD_SQUARES:
+        square = board[sq]
+        if square & WHITE:
+            score += pieceScore[square & PIECE_TYPE]
+        elif square & BLACK:
+            score -= pieceScore[square & PIECE_TYPE]
@@ -1,188 +1,340 @@
-from moves import MoveGenerator, Move, CastleRights
+import random
+from array import array
+from moves import (MoveGenerator, Move, BoardView, emptyMailbox, squareIndex, PIECE_CODES, TACTICAL_MOVES,
+                   QUIET_MOVES, ALL_MOVES, SQUARES_MASK, BOARD_SQUARES, SQUARE_COL, ORTHOGONAL_RAYS, DIAGONAL_RAYS,
+                   KNIGHT_TARGETS, KING_TARGETS, PAWN_CAPTURES, CASTLE_WKS, CASTLE_BKS, CASTLE_WQS, CASTLE_BQS,
+                   ALL_CASTLE_RIGHTS, EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, PIECE_TYPE,
+                   PIECE_COLOR, NO_SQUARE)
+from evaluation import MIDDLEGAME_SCORES, ENDGAME_SCORES, PHASE, taperedScore
+
+# Zobrist keys: one random 64-bit number per (piece, square), plus side to move, castling rights and en passant file
+zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = [[zobristRandom.getrandbits(64) for _ in range(120)] if code != EMPTY else None
+                  for code in range(BLACK | KING + 1)]
+ZOBRIST_BLACK_TO_MOVE = zobristRandom.getrandbits(64)
+ZOBRIST_CASTLE = [zobristRandom.getrandbits(64) for _ in range(4)]  # wks, bks, wqs, bqs
+ZOBRIST_ENPASSANT = [zobristRandom.getrandbits(64) for _ in range(8)]  # One per file
+# Key of every 4-bit castling rights value, bit i of the rights selecting ZOBRIST_CASTLE[i]
+ZOBRIST_CASTLE_RIGHTS = [0] * 16
+for rights in range(16):
+    for i in range(4):
+        if rights >> i & 1:
+            ZOBRIST_CASTLE_RIGHTS[rights] ^= ZOBRIST_CASTLE[i]
+
+WHITE_KING, BLACK_KING = WHITE | KING, BLACK | KING
+WHITE_ROOK, BLACK_ROOK = WHITE | ROOK, BLACK | ROOK
+SLIDER_RAYS = {BISHOP: (DIAGONAL_RAYS,), ROOK: (ORTHOGONAL_RAYS,), QUEEN: (ORTHOGONAL_RAYS, DIAGONAL_RAYS)}
+# Castling rights kept when a move starts or ends on a square: touching a king or rook home square loses them
+CASTLE_MASK = [ALL_CASTLE_RIGHTS] * 120
+CASTLE_MASK[squareIndex(7, 4)] = ALL_CASTLE_RIGHTS & ~(CASTLE_WKS | CASTLE_WQS)
+CASTLE_MASK[squareIndex(7, 7)] = ALL_CASTLE_RIGHTS & ~CASTLE_WKS
+CASTLE_MASK[squareIndex(7, 0)] = ALL_CASTLE_RIGHTS & ~CASTLE_WQS
+CASTLE_MASK[squareIndex(0, 4)] = ALL_CASTLE_RIGHTS & ~(CASTLE_BKS | CASTLE_BQS)
+CASTLE_MASK[squareIndex(0, 7)] = ALL_CASTLE_RIGHTS & ~CASTLE_BKS
+CASTLE_MASK[squareIndex(0, 0)] = ALL_CASTLE_RIGHTS & ~CASTLE_BQS
+UNDO_STACK_SIZE = 1024  # Plies preallocated for undo records, doubled if a game gets longer
+ORDER_VALUE = (0, 1, 3, 3, 5, 9, 10)  # Victim / attacker value by piece type for MVV-LVA ordering
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
 
 class GameState(MoveGenerator):
 
-    def __init__(self):
+    def __init__(self, fen=START_FEN):
         super().__init__()
-        self.board = [
-            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"], 
-            ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
-            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]]
-        
-        self.moveFunctions = {"p": self.getPawnMoves, "R": self.getRookMoves, "N": self.getKnightMoves,
-                              "B": self.getBishopMoves, "Q": self.getQueenMoves, "K": self.getKingMoves}
-        self.whiteToMove = True
+        self.mailbox = emptyMailbox()  # 10x12 bytearray of piece codes with an OFFBOARD border
+        self.board = BoardView(self.mailbox)  # board[row][col] piece names for drawing
+        self.moveFunctions = {PAWN: self.getPawnMoves, ROOK: self.getRookMoves, KNIGHT: self.getKnightMoves,
+                              BISHOP: self.getBishopMoves, QUEEN: self.getQueenMoves, KING: self.getKingMoves}
+        self.loadFen(fen)
+
+    def loadFen(self, fen):
+        """Sets up the position described by a FEN string and clears the move history"""
+        self.startFen = fen  # Replaying moveLog from here rebuilds the game, e.g. in another process
+        fields = fen.split()
+        placement = fields[0]
+        side = fields[1] if len(fields) > 1 else "w"
+        castling = fields[2] if len(fields) > 2 else "-"
+        enpassant = fields[3] if len(fields) > 3 else "-"
+
+        self.mailbox[:] = emptyMailbox()
+        for row, rank in enumerate(placement.split("/")):
+            column = 0
+            for char in rank:
+                if char.isdigit():
+                    column += int(char)
+                    continue
+                piece = ("w" if char.isupper() else "b") + ("p" if char in "Pp" else char.upper())
+                sq = squareIndex(row, column)
+                self.mailbox[sq] = PIECE_CODES[piece]
+                if piece == "wK":
+                    self.whiteKingLocation = sq  # Mailbox squares
+                elif piece == "bK":
+                    self.blackKingLocation = sq
+                column += 1
+
+        self.whiteToMove = side == "w"
         self.moveLog = []
-        self.whiteKingLocation , self.blackKingLocation = (7, 4), (0, 4)
         self.inCheck = False
         self.checkmate, self.stalemate = False, False
-        self.pins, self.checks = [], []
-        self.enpassantPossible = ()  # Coordinates for the square where en passant capture is possible
-        self.currentCastleRights = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastleRights.wks, self.currentCastleRights.bks,
-                                             self.currentCastleRights.wqs, self.currentCastleRights.bqs)]
-        self.fiftyMoveCounter = 0
-        self.positionLog = {}
-
-    def makeMove(self, move, choice='Q'):
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        self.moveLog.append((move, self.enpassantPossible))
+        self.pins, self.checks = [0] * 120, []  # Pin direction per mailbox square, list of (square, direction) checks
+        self.attackMap = bytearray(120)  # Squares attacked by the opponent, refreshed by getValidMoves
+        self.enpassantPossible = NO_SQUARE  # Mailbox square where en passant capture is possible
+        if enpassant != "-":
+            self.enpassantPossible = squareIndex(Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+        self.castleRights = 0  # CASTLE_WKS | CASTLE_BKS | CASTLE_WQS | CASTLE_BQS bits
+        for char, right in (("K", CASTLE_WKS), ("k", CASTLE_BKS), ("Q", CASTLE_WQS), ("q", CASTLE_BQS)):
+            if char in castling:
+                self.castleRights |= right
+        self.fiftyMoveCounter = int(fields[4]) if len(fields) > 4 else 0
+        self.zobristKey = self.computeZobristKey()
+        self.pawnKey = self.computePawnKey()  # Zobrist key of the pawns alone, for the pawn hash table
+        self.positionLog = {self.zobristKey: 1}  # Zobrist key -> number of times the position occurred
+        # Material + piece-square scores for white, kept up to date by makeMove / undoMove
+        self.middlegameScore, self.endgameScore, self.phase = self.computeEvaluation()
+        self.pieceCount = sum(1 for sq in BOARD_SQUARES if self.mailbox[sq] != EMPTY)  # Kings included
+        self.nullMoveLog = []  # (en passant square, Zobrist key) before each null move
+
+        # Undo records, one per ply in parallel preallocated arrays: what makeMove can't work out backwards
+        self.undoCaptured = bytearray(UNDO_STACK_SIZE)
+        self.undoCastleRights = bytearray(UNDO_STACK_SIZE)
+        self.undoEnpassant = bytearray(UNDO_STACK_SIZE)
+        self.undoFiftyMoveCounter = array("I", bytes(4 * UNDO_STACK_SIZE))
+        self.undoZobristKey = array("Q", bytes(8 * UNDO_STACK_SIZE))
+        self.undoPawnKey = array("Q", bytes(8 * UNDO_STACK_SIZE))
+
+    def growUndoStack(self):
+        for stack in (self.undoCaptured, self.undoCastleRights, self.undoEnpassant,
+                      self.undoFiftyMoveCounter, self.undoZobristKey, self.undoPawnKey):
+            stack.extend(stack)
+
+    def makeMove(self, move):
+        board = self.mailbox
+        startSq, endSq = move.startSq, move.endSq
+        pieceMoved = board[startSq]
+        captureSq = startSq - SQUARE_COL[startSq] + SQUARE_COL[endSq] if move.isEnpassantMove else endSq
+        pieceCaptured = board[captureSq]
+
+        ply = len(self.moveLog)
+        if ply == len(self.undoZobristKey):
+            self.growUndoStack()
+        self.undoCaptured[ply] = pieceCaptured
+        self.undoCastleRights[ply] = self.castleRights
+        self.undoEnpassant[ply] = self.enpassantPossible
+        self.undoFiftyMoveCounter[ply] = self.fiftyMoveCounter
+        self.undoZobristKey[ply] = self.zobristKey
+        self.undoPawnKey[ply] = self.pawnKey
+        self.moveLog.append(move)
+
+        key = self.zobristKey ^ ZOBRIST_CASTLE_RIGHTS[self.castleRights] ^ self.enpassantKey()
+        key ^= ZOBRIST_PIECES[pieceMoved][startSq]
+        if pieceCaptured != EMPTY:
+            key ^= ZOBRIST_PIECES[pieceCaptured][captureSq]
+        board[startSq] = EMPTY
+        board[captureSq] = EMPTY # Only differs from the landing square for en passant
+        board[endSq] = pieceMoved
         self.whiteToMove = not self.whiteToMove
-        if move.pieceMoved == "wK":
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        elif move.pieceMoved == "bK":
-            self.blackKingLocation = (move.endRow, move.endCol)
-        
+        if pieceMoved == WHITE_KING:
+            self.whiteKingLocation = endSq
+        elif pieceMoved == BLACK_KING:
+            self.blackKingLocation = endSq
+
         if move.isPawnPromotion:
-            promote = ''
-            if choice == 'B':
-                promote = move.pieceMoved[0] + 'B'
-            elif choice == 'N':
-                promote = move.pieceMoved[0] + 'N'
-            elif choice == 'R':
-                promote = move.pieceMoved[0] + 'R'
-            else:
-                promote = move.pieceMoved[0] + 'Q'
-            
-            self.board[move.endRow][move.endCol] = promote
-            
-        if move.isEnpassantMove:
-            self.board[move.startRow][move.endCol] = "--" # Capturing the pawn
-        
+            board[endSq] = (pieceMoved & PIECE_COLOR) | move.promotion
+
         # Update enpassantPossible variable
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:# Only on 2 square pawn advance
-            self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.startCol)
+        if pieceMoved & PIECE_TYPE == PAWN and abs(startSq - endSq) == 20:# Only on 2 square pawn advance
+            self.enpassantPossible = (startSq + endSq) // 2
         else:
-            self.enpassantPossible = ()
-        
+            self.enpassantPossible = NO_SQUARE
+
         if move.isCastleMove:
-            if move.endCol - move.startCol == 2: # King side castle
-                self.board[move.endRow][move.endCol-1] = self.board[move.endRow][move.endCol+1]
-                self.board[move.endRow][move.endCol+1] = '--'
+            if endSq - startSq == 2: # King side castle
+                rookFrom, rookTo = endSq + 1, endSq - 1
             else: # Queen side castle
-                self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-2]
-                self.board[move.endRow][move.endCol-2] = '--'
-        
-        # Update castling rights - whenever it is a rook or a king move
-        self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastleRights.wks, self.currentCastleRights.bks,
-                                                 self.currentCastleRights.wqs, self.currentCastleRights.bqs))
+                rookFrom, rookTo = endSq - 2, endSq + 1
+            board[rookTo] = board[rookFrom]
+            board[rookFrom] = EMPTY
+            key ^= ZOBRIST_PIECES[board[rookTo]][rookFrom] ^ ZOBRIST_PIECES[board[rookTo]][rookTo]
+
+        # Update castling rights - whenever a king or rook leaves its home square or a rook is captured on it
+        self.castleRights &= CASTLE_MASK[startSq] & CASTLE_MASK[endSq]
+
+        # Finish the Zobrist key: landing piece, new castling rights / en passant file and side to move
+        key ^= ZOBRIST_PIECES[board[endSq]][endSq]
+        self.zobristKey = key ^ ZOBRIST_CASTLE_RIGHTS[self.castleRights] ^ self.enpassantKey() ^ ZOBRIST_BLACK_TO_MOVE
+        if pieceMoved & PIECE_TYPE == PAWN:  # Pawn moves and pawn captures are all that change the pawn key
+            self.pawnKey ^= ZOBRIST_PIECES[pieceMoved][startSq]
+            if not move.isPawnPromotion:
+                self.pawnKey ^= ZOBRIST_PIECES[pieceMoved][endSq]
+        if pieceCaptured & PIECE_TYPE == PAWN:
+            self.pawnKey ^= ZOBRIST_PIECES[pieceCaptured][captureSq]
+
+        # Update the evaluation: the piece leaves its square, lands (maybe promoted), the capture and castled rook go
+        pieceLanded = board[endSq]
+        middlegame = MIDDLEGAME_SCORES[pieceLanded][endSq] - MIDDLEGAME_SCORES[pieceMoved][startSq]
+        endgame = ENDGAME_SCORES[pieceLanded][endSq] - ENDGAME_SCORES[pieceMoved][startSq]
+        if pieceCaptured != EMPTY:
+            middlegame -= MIDDLEGAME_SCORES[pieceCaptured][captureSq]
+            endgame -= ENDGAME_SCORES[pieceCaptured][captureSq]
+            self.phase -= PHASE[pieceCaptured]
+            self.pieceCount -= 1
+        if move.isPawnPromotion:
+            self.phase += PHASE[pieceLanded]
+        elif move.isCastleMove:
+            rook = board[rookTo]
+            middlegame += MIDDLEGAME_SCORES[rook][rookTo] - MIDDLEGAME_SCORES[rook][rookFrom]
+            endgame += ENDGAME_SCORES[rook][rookTo] - ENDGAME_SCORES[rook][rookFrom]
+        self.middlegameScore += middlegame
+        self.endgameScore += endgame
 
         # Update fifty-move rule counter
-        if move.pieceCaptured == "--" and move.pieceMoved[1] != 'p':
+        if pieceCaptured == EMPTY and pieceMoved & PIECE_TYPE != PAWN:
             self.fiftyMoveCounter += 1
         else:
             self.fiftyMoveCounter = 0
 
         # Update position log for threefold repetition
-        board_tuple = tuple(tuple(row) for row in self.board)
-        if board_tuple in self.positionLog:
-            self.positionLog[board_tuple] += 1
-        else:
-            self.positionLog[board_tuple] = 1
+        self.positionLog[self.zobristKey] = self.positionLog.get(self.zobristKey, 0) + 1
 
     def undoMove(self):
         if len(self.moveLog) != 0:
-            move, self.enpassantPossible = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            board = self.mailbox
+            # Update position log for threefold repetition before leaving the position
+            self.positionLog[self.zobristKey] -= 1
+
+            move = self.moveLog.pop()
+            ply = len(self.moveLog)
+            pieceCaptured = self.undoCaptured[ply]
+            self.castleRights = self.undoCastleRights[ply]
+            self.enpassantPossible = self.undoEnpassant[ply]
+            self.fiftyMoveCounter = self.undoFiftyMoveCounter[ply]
+            self.zobristKey = self.undoZobristKey[ply]
+            self.pawnKey = self.undoPawnKey[ply]
+
+            startSq, endSq = move.startSq, move.endSq
+            pieceLanded = board[endSq]
+            pieceMoved = pieceLanded
+            if move.isPawnPromotion:
+                pieceMoved = (pieceMoved & PIECE_COLOR) | PAWN
+                self.phase -= PHASE[pieceLanded]
+            self.middlegameScore -= MIDDLEGAME_SCORES[pieceLanded][endSq] - MIDDLEGAME_SCORES[pieceMoved][startSq]
+            self.endgameScore -= ENDGAME_SCORES[pieceLanded][endSq] - ENDGAME_SCORES[pieceMoved][startSq]
+            if pieceCaptured != EMPTY:
+                captureSq = startSq - SQUARE_COL[startSq] + SQUARE_COL[endSq] if move.isEnpassantMove else endSq
+                self.middlegameScore += MIDDLEGAME_SCORES[pieceCaptured][captureSq]
+                self.endgameScore += ENDGAME_SCORES[pieceCaptured][captureSq]
+                self.phase += PHASE[pieceCaptured]
+                self.pieceCount += 1
+            board[startSq] = pieceMoved
+            board[endSq] = pieceCaptured
             self.whiteToMove = not self.whiteToMove
-            if move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == "bK":
-                self.blackKingLocation = (move.startRow, move.startCol)
+            if pieceMoved == WHITE_KING:
+                self.whiteKingLocation = startSq
+            elif pieceMoved == BLACK_KING:
+                self.blackKingLocation = startSq
             # Undo enpassant move
             if move.isEnpassantMove:
-                self.board[move.endRow][move.endCol] = "--" # Leave landing square blank
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-            # Undo 2 square pawn advance
-            if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
-            # Undo castling rights
-            self.castleRightsLog.pop() # Get rid of new castle rights from the move we are undoing
-            castleRights = self.castleRightsLog[-1] # Set the current castle rights to the last one in the list
-            self.currentCastleRights = CastleRights(castleRights.wks, castleRights.bks, castleRights.wqs, castleRights.bqs)
+                board[endSq] = EMPTY # Leave landing square blank
+                board[startSq - SQUARE_COL[startSq] + SQUARE_COL[endSq]] = pieceCaptured
             # Undo castle move
             if move.isCastleMove:
-                if move.endCol - move.startCol == 2:
-                    self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-1]
-                    self.board[move.endRow][move.endCol-1] = '--'
+                if endSq - startSq == 2:
+                    rookFrom, rookTo = endSq + 1, endSq - 1
                 else:
-                    self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1]
-                    self.board[move.endRow][move.endCol+1] = '--'
+                    rookFrom, rookTo = endSq - 2, endSq + 1
+                rook = board[rookTo]
+                board[rookFrom] = rook
+                board[rookTo] = EMPTY
+                self.middlegameScore -= MIDDLEGAME_SCORES[rook][rookTo] - MIDDLEGAME_SCORES[rook][rookFrom]
+                self.endgameScore -= ENDGAME_SCORES[rook][rookTo] - ENDGAME_SCORES[rook][rookFrom]
             self.checkmate, self.stalemate = False, False
 
-            # Update fifty-move rule counter
-            if move.pieceCaptured == "--" and move.pieceMoved[1] != 'p':
-                self.fiftyMoveCounter -= 1
-            else:
-                self.fiftyMoveCounter = 0
-
-            # Update position log for threefold repetition
-            board_tuple = tuple(tuple(row) for row in self.board)
-            if board_tuple in self.positionLog:
-                self.positionLog[board_tuple] -= 1
-
-    def updateCastleRights(self, move):
-        if move.pieceMoved == 'wK':
-            self.currentCastleRights.wks = self.currentCastleRights.wqs = False
-        elif move.pieceMoved == 'bK':
-            self.currentCastleRights.bks = self.currentCastleRights.bqs = False
-        elif move.pieceMoved == 'wR':
-            if move.startRow == 7:
-                if move.startCol == 0:
-                    self.currentCastleRights.wqs = False
-                elif move.startCol == 7:
-                    self.currentCastleRights.wks = False
-        elif move.pieceMoved == 'bR':
-            if move.startRow == 0:
-                if move.startCol == 0:
-                    self.currentCastleRights.bqs = False
-                elif move.startCol == 7:
-                    self.currentCastleRights.bks = False
+    def makeNullMove(self):
+        """Passes the turn without moving, for null-move pruning. Not counted for repetitions; undo with undoNullMove"""
+        self.nullMoveLog.append((self.enpassantPossible, self.zobristKey))
+        self.zobristKey ^= self.enpassantKey() ^ ZOBRIST_BLACK_TO_MOVE
+        self.enpassantPossible = NO_SQUARE
+        self.whiteToMove = not self.whiteToMove
+
+    def undoNullMove(self):
+        self.enpassantPossible, self.zobristKey = self.nullMoveLog.pop()
+        self.whiteToMove = not self.whiteToMove
+
+    def hasNonPawnMaterial(self):
+        """Whether the side to move has a piece besides its king and pawns (zugzwang is rare then)"""
+        ally = WHITE if self.whiteToMove else BLACK
+        for sq in BOARD_SQUARES:
+            piece = self.mailbox[sq]
+            if piece & ally and piece & PIECE_TYPE not in (PAWN, KING):
+                return True
+        return False
+
+    def capturedPiece(self, move):
+        """Piece code the move would capture (EMPTY if none), read before the move is made"""
+        if move.isEnpassantMove:
+            return self.mailbox[move.startSq] ^ PIECE_COLOR  # The other side's pawn
+        return self.mailbox[move.endSq]
+
+    def computeZobristKey(self):
+        """Computes the Zobrist key of the current position from scratch"""
+        key = 0
+        for sq in BOARD_SQUARES:
+            piece = self.mailbox[sq]
+            if piece != EMPTY:
+                key ^= ZOBRIST_PIECES[piece][sq]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ self.castleRightsKey() ^ self.enpassantKey()
+
+    def computePawnKey(self):
+        """Computes the pawn-only Zobrist key of the current position from scratch"""
+        key = 0
+        for sq in BOARD_SQUARES:
+            piece = self.mailbox[sq]
+            if piece & PIECE_TYPE == PAWN:
+                key ^= ZOBRIST_PIECES[piece][sq]
+        return key
+
+    def computeEvaluation(self):
+        """Computes (middlegame score, endgame score, phase) of the current position from scratch"""
+        middlegame, endgame, phase = 0, 0, 0
+        for sq in BOARD_SQUARES:
+            piece = self.mailbox[sq]
+            if piece != EMPTY:
+                middlegame += MIDDLEGAME_SCORES[piece][sq]
+                endgame += ENDGAME_SCORES[piece][sq]
+                phase += PHASE[piece]
+        return middlegame, endgame, phase
+
+    def evaluation(self):
+        """Tapered material and piece-square score in centipawns, positive when white is better"""
+        return taperedScore(self.middlegameScore, self.endgameScore, self.phase)
+
+    def castleRightsKey(self):
+        return ZOBRIST_CASTLE_RIGHTS[self.castleRights]
+
+    def enpassantKey(self):
+        """Only hashes the en passant file when a pawn of the side to move can actually capture"""
+        if self.enpassantPossible == NO_SQUARE:
+            return 0
+        if self.whiteToMove:
+            pawn, pawnSq = WHITE | PAWN, self.enpassantPossible + 10
+        else:
+            pawn, pawnSq = BLACK | PAWN, self.enpassantPossible - 10
+        if self.mailbox[pawnSq - 1] == pawn or self.mailbox[pawnSq + 1] == pawn:
+            return ZOBRIST_ENPASSANT[SQUARE_COL[self.enpassantPossible]]
+        return 0
 
     def getValidMoves(self):
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = CastleRights(self.currentCastleRights.wks, self.currentCastleRights.bks,
-                                        self.currentCastleRights.wqs, self.currentCastleRights.bqs)
         """Gets all moves considering checks"""
         moves = []
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        self.attackMap = self.getAttackMap()  # Shared by king moves, castling and evaluation
 
         # Updates king locations
-        if self.whiteToMove:
-            king_row, king_column = self.whiteKingLocation[0], self.whiteKingLocation[1]
-        else:
-            king_row, king_column = self.blackKingLocation[0], self.blackKingLocation[1]
+        kingSq = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
 
         if self.inCheck:
-            if len(self.checks) == 1:  # Only 1 check: block check or move king
-                moves = self.getAllPossibleMoves()
-                check = self.checks[0]
-                check_row, check_column = check[0], check[1]
-                piece_checking = self.board[check_row][check_column]  # Enemy piece causing check
-                valid_squares = []
-                if piece_checking[1] == 'N':# If knight, must capture knight or move king
-                    valid_squares = [(check_row, check_column)]
-                else:# If rook, bishop, or queen, block check or move king
-                    for i in range(1, len(self.board)):
-                        valid_square = (king_row + check[2] * i, king_column + check[3] * i)  # 2 & 3 = check directions
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[1] == check_column:# Once you reach piece and check
-                            break
-                for i in range(len(moves) - 1, -1, -1):  # Gets rid of move not blocking, checking, or moving king
-                    if moves[i].pieceMoved[1] != 'K':
-                        if not (moves[i].endRow, moves[i].endCol) in valid_squares:
-                            moves.remove(moves[i])
-            else:  # Double check, king must move
-                self.getKingMoves(king_row, king_column, moves, self.board, self.whiteToMove)
+            self.getCheckEvasions(kingSq, moves, self.mailbox, self.whiteToMove)
         else:  # Not in check
             moves = self.getAllPossibleMoves()
 
@@ -190,116 +342,220 @@ class GameState(MoveGenerator):
             self.checkmate, self.stalemate = self.inCheck, not self.inCheck
         else:
             self.checkmate, self.stalemate = False, False
-            
-        if self.whiteToMove:
-            self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves, self.board, self.whiteToMove)
-        else:
-            self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves, self.board, self.whiteToMove)
-        
-        self.enpassantPossible = tempEnpassantPossible
-        self.currentCastleRights = tempCastleRights 
-
-        # Check for fifty-move rule
-        if self.fiftyMoveCounter >= 50:
-            self.stalemate = True
 
-        # Check for threefold repetition
-        board_tuple = tuple(tuple(row) for row in self.board)
-        if self.positionLog.get(board_tuple, 0) >= 3:
-            self.stalemate = True
+        self.getCastleMoves(kingSq, moves, self.mailbox, self.whiteToMove)
 
-        # Check for insufficient material
-        if self.insufficientMaterial():
+        if self.isDraw():
             self.stalemate = True
 
         return moves
 
-    def getAllPossibleMoves(self):
+    def isDraw(self):
+        """Fifty-move rule, threefold repetition or insufficient material"""
+        return self.fiftyMoveCounter >= 50 or self.positionLog.get(self.zobristKey, 0) >= 3 or \
+            self.insufficientMaterial()
+
+    def orderedMoves(self, hashMove=None, capturesOnly=False, killers=(), history=None):
+        """Yields the legal moves in stages: the hash move, captures by MVV-LVA, promotions, then quiet moves.
+        Each stage is only generated when the caller asks for its first move, so a search that stops after a
+        cutoff never pays for the rest. capturesOnly stops after the promotions (all evasions are yielded in check).
+        Quiet moves start with the killers that are legal here, then go by history[move.moveID & SQUARES_MASK].
+        Unlike getValidMoves this does not set checkmate / stalemate."""
+        board, whiteToMove = self.mailbox, self.whiteToMove
+        inCheck, pins, checks = self.checkForPinsAndChecks()
+        attackMap = self.getAttackMap()
+        self.inCheck, self.checks, self.attackMap = inCheck, checks, attackMap
+        kingSq = self.whiteKingLocation if whiteToMove else self.blackKingLocation
+
+        if inCheck:  # Few evasions, so generate them all and just order them
+            checkmate, stalemate = self.checkmate, self.stalemate
+            moves = self.getValidMoves()
+            self.checkmate, self.stalemate = checkmate, stalemate
+            if hashMove in moves:
+                yield hashMove
+            moves.sort(key=self.moveOrderValue, reverse=True)
+            for move in moves:
+                if move != hashMove:
+                    yield move
+            return
+
+        if hashMove is not None and board[hashMove.startSq] & (WHITE if whiteToMove else BLACK):
+            # Only trust the hash move if the piece on its start square can still make it
+            pieceMoves = []
+            self.pins = pins
+            self.moveFunctions[board[hashMove.startSq] & PIECE_TYPE](hashMove.startSq, pieceMoves, board, whiteToMove)
+            if hashMove.startSq == kingSq:
+                self.getCastleMoves(kingSq, pieceMoves, board, whiteToMove)
+            if hashMove in pieceMoves:
+                yield hashMove
+            else:
+                hashMove = None
+
+        # The caller may search below any yield, which overwrites the pins and attack map, so restore them per stage
+        self.pins, self.attackMap, self.inCheck = pins, attackMap, False
+        tactical = self.getAllPossibleMoves(TACTICAL_MOVES)
+        tactical.sort(key=self.moveOrderValue, reverse=True)
+        for move in tactical:
+            if not move.isPawnPromotion and move != hashMove:
+                yield move
+        for move in tactical:
+            if move.isPawnPromotion and move != hashMove:
+                yield move
+        if capturesOnly:
+            return
+
+        self.pins, self.attackMap, self.inCheck = pins, attackMap, False
+        quiets = self.getAllPossibleMoves(QUIET_MOVES)
+        self.getCastleMoves(kingSq, quiets, board, whiteToMove)
+        searched = [hashMove]
+        for killer in killers:
+            if killer is not None and killer not in searched and killer in quiets:
+                searched.append(killer)
+                yield killer
+        if history is not None:
+            quiets.sort(key=lambda move: history[move.moveID & SQUARES_MASK], reverse=True)
+        for move in quiets:
+            if move not in searched:
+                yield move
+
+    def moveOrderValue(self, move):
+        """MVV-LVA: most valuable victim first, then least valuable attacker; queen promotions before others"""
+        score = ORDER_VALUE[self.capturedPiece(move) & PIECE_TYPE] * 16 - ORDER_VALUE[self.mailbox[move.startSq] & PIECE_TYPE]
+        if move.isPawnPromotion:
+            score += ORDER_VALUE[move.promotion] * 16
+        return score
+
+    def getAllPossibleMoves(self, kinds=ALL_MOVES):
         """Gets all moves without considering checks"""
         moves = []
-        for row in range(len(self.board)):  # Number of rows
-            for column in range(len(self.board[row])):  # Number of columns in each row
-                turn = self.board[row][column][0]
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[row][column][1]
-                    self.moveFunctions[piece](row, column, moves, self.board, self.whiteToMove)  # Calls move function based on piece type
+        board = self.mailbox
+        ally = WHITE if self.whiteToMove else BLACK
+        for sq in BOARD_SQUARES:
+            piece = board[sq]
+            if piece & ally:
+                self.moveFunctions[piece & PIECE_TYPE](sq, moves, board, self.whiteToMove, kinds)  # Calls move function based on piece type
         return moves
 
     def checkForPinsAndChecks(self):
-        """Returns if the player is in check, a list of pins, and a list of checks"""
-        pins = []
+        """Returns if the player is in check, a 120-entry list with the pin direction of every pinned piece (0 elsewhere),
+        and a list of (square, direction) checks"""
+        pins = [0] * 120
         checks = []
         inCheck = False
+        board = self.mailbox
 
         if self.whiteToMove:
-            opponent, ally = 'b', 'w'
-            startRow, startCol = self.whiteKingLocation
+            opponent, ally = BLACK, WHITE
+            kingSq = self.whiteKingLocation
+            pawnDirections = (-11, -9)  # Black pawns attack downwards, so they sit above the king
         else:
-            opponent, ally = 'w', 'b'
-            startRow, startCol = self.blackKingLocation
-
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
-            possiblePin = ()  # Resets possible pins
-            for i in range(1, len(self.board)):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board):
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == ally and endPiece[1] != 'K':
-                        if possiblePin == ():  # 1st ally piece can be pinned
-                            possiblePin = (endRow, endCol, d[0], d[1])
+            opponent, ally = WHITE, BLACK
+            kingSq = self.blackKingLocation
+            pawnDirections = (9, 11)
+
+        for rays, slider in ((ORTHOGONAL_RAYS, ROOK), (DIAGONAL_RAYS, BISHOP)):
+            for d, ray in rays[kingSq]:
+                possiblePin = 0  # Resets possible pins
+                for endSq in ray:
+                    endPiece = board[endSq]
+                    if endPiece & ally:
+                        if endPiece & PIECE_TYPE == KING:  # The king itself when probing its own moves
+                            pass
+                        elif not possiblePin:  # 1st ally piece can be pinned
+                            possiblePin = endSq
                         else:  # 2nd ally piece, so no pin or check possible
                             break
-                    elif endPiece[0] == opponent:
-                        pieceType = endPiece[1]
-                        if (0 <= j <= 3 and pieceType == 'R') or (4 <= j <= 7 and pieceType == 'B') or \
-                                (i == 1 and pieceType == 'p' and ((opponent == 'w' and 6 <= j <= 7)
-                                                                   or (opponent == 'b' and 4 <= j <= 5))) or \
-                                (pieceType == 'Q') or (i == 1 and pieceType == 'K'):
-                            if possiblePin == ():  # no piece blocking, so check
+                    elif endPiece & opponent:
+                        pieceType = endPiece & PIECE_TYPE
+                        adjacent = endSq == kingSq + d
+                        if pieceType == slider or pieceType == QUEEN or \
+                                (adjacent and pieceType == PAWN and d in pawnDirections) or \
+                                (adjacent and pieceType == KING):
+                            if not possiblePin:  # no piece blocking, so check
                                 inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
+                                checks.append((endSq, d))
                             else:  # Piece blocking, so pin
-                                pins.append(possiblePin)
-                                break
-                        else:  # Enemy piece but not applying check
-                            break
-                else:  # Off board
-                    break
+                                pins[possiblePin] = d
+                        break  # Enemy piece either checks, pins or blocks the ray
 
         # Check for knight checks cause they are a bit different
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for move in knightMoves:
-            endRow = startRow + move[0]
-            endCol = startCol + move[1]
-            if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board):
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == opponent and endPiece[1] == 'N':
-                    inCheck = True
-                    checks.append((endRow, endCol, move[0], move[1]))
+        knight = opponent | KNIGHT
+        for endSq in KNIGHT_TARGETS[kingSq]:
+            if board[endSq] == knight:
+                inCheck = True
+                checks.append((endSq, endSq - kingSq))
 
         return inCheck, pins, checks
 
-    def squareUnderAttack(self, row, col):
-        """Determine if a square is under attack by any of the opponent's pieces"""
-        self.whiteToMove = not self.whiteToMove  # Switch to opponent's turn
-        opponent_moves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove  # Switch turns back
-        for move in opponent_moves:
-            if move.endRow == row and move.endCol == col:
+    def squareUnderAttack(self, sq):
+        """Determine if a square is under attack by any of the opponent's pieces, looking outward from the square"""
+        board = self.mailbox
+        opponent, ally = (BLACK, WHITE) if self.whiteToMove else (WHITE, BLACK)
+        pawn, knight, king, queen = opponent | PAWN, opponent | KNIGHT, opponent | KING, opponent | QUEEN
+        for d, endSq in PAWN_CAPTURES[ally][sq]:  # Where an enemy pawn would have to stand
+            if board[endSq] == pawn:
                 return True
+        for endSq in KNIGHT_TARGETS[sq]:
+            if board[endSq] == knight:
+                return True
+        for endSq in KING_TARGETS[sq]:
+            if board[endSq] == king:
+                return True
+        for rays, slider in ((ORTHOGONAL_RAYS, opponent | ROOK), (DIAGONAL_RAYS, opponent | BISHOP)):
+            for d, ray in rays[sq]:
+                for endSq in ray:
+                    endPiece = board[endSq]
+                    if endPiece != EMPTY:
+                        if endPiece == slider or endPiece == queen:
+                            return True
+                        break
         return False
 
+    def getAttackMap(self):
+        """Returns a 120-entry map with 1 on every square the opponent attacks, computed in one pass over its pieces.
+        The side to move's king is lifted off the board first, so squares behind it on a checking ray count as attacked."""
+        board = self.mailbox
+        attacked = bytearray(120)
+        if self.whiteToMove:
+            opponent, kingSq = BLACK, self.whiteKingLocation
+        else:
+            opponent, kingSq = WHITE, self.blackKingLocation
+        pawnCaptures = PAWN_CAPTURES[opponent]
+        king = board[kingSq]
+        board[kingSq] = EMPTY
+        for sq in BOARD_SQUARES:
+            piece = board[sq]
+            if not piece & opponent:
+                continue
+            pieceType = piece & PIECE_TYPE
+            if pieceType == PAWN:
+                for d, endSq in pawnCaptures[sq]:
+                    attacked[endSq] = 1
+            elif pieceType == KNIGHT:
+                for endSq in KNIGHT_TARGETS[sq]:
+                    attacked[endSq] = 1
+            elif pieceType == KING:
+                for endSq in KING_TARGETS[sq]:
+                    attacked[endSq] = 1
+            else:
+                for rays in SLIDER_RAYS[pieceType]:
+                    for d, ray in rays[sq]:
+                        for endSq in ray:
+                            attacked[endSq] = 1  # The first piece on the ray is attacked (or defended) too
+                            if board[endSq] != EMPTY:
+                                break
+        board[kingSq] = king
+        return attacked
+
     def insufficientMaterial(self):
         """Check for insufficient material to checkmate"""
-        pieces = [piece for row in self.board for piece in row if piece != "--"]
+        if self.pieceCount > 3:
+            return False
+        pieces = [self.mailbox[sq] for sq in BOARD_SQUARES if self.mailbox[sq] != EMPTY]
         if len(pieces) == 2:
             return True  # Only kings left
         if len(pieces) == 3:
-            if pieces.count("wK") == 1 and pieces.count("bK") == 1:
-                if pieces.count("wB") == 1 or pieces.count("wN") == 1 or pieces.count("bB") == 1 or pieces.count("bN") == 1:
+            for piece in pieces:
+                if piece & PIECE_TYPE in (BISHOP, KNIGHT):
                     return True  # One side has only king and bishop/knight
-        return False
\ No newline at end of file
+        return False
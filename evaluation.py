@@ -0,0 +1,118 @@
+"""Piece values and piece-square tables for the tapered evaluation that GameState keeps up to date.
+Scores are centipawns from white's point of view; the tables are laid out like the UI board, a8 first."""
+from moves import squareIndex, PIECE_TYPE, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK
+
+# (middlegame, endgame) material values by piece type
+PIECE_VALUES = {PAWN: (100, 120), KNIGHT: (320, 300), BISHOP: (330, 320), ROOK: (500, 520), QUEEN: (900, 900),
+                KING: (0, 0)}
+
+PAWN_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0)
+PAWN_ENDGAME_TABLE = (  # Advanced pawns are worth more once the pieces are gone
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     15,  15,  15,  15,  15,  15,  15,  15,
+      5,   5,   5,   5,   5,   5,   5,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+      0,   0,   0,   0,   0,   0,   0,   0)
+KNIGHT_TABLE = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50)
+BISHOP_TABLE = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20)
+ROOK_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0)
+QUEEN_TABLE = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20)
+KING_TABLE = (  # Middlegame: stay castled behind the pawns
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20)
+KING_ENDGAME_TABLE = (  # Endgame: walk to the centre
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50)
+
+# (middlegame table, endgame table) by piece type
+PIECE_SQUARE_TABLES = {PAWN: (PAWN_TABLE, PAWN_ENDGAME_TABLE), KNIGHT: (KNIGHT_TABLE, KNIGHT_TABLE),
+                       BISHOP: (BISHOP_TABLE, BISHOP_TABLE), ROOK: (ROOK_TABLE, ROOK_TABLE),
+                       QUEEN: (QUEEN_TABLE, QUEEN_TABLE), KING: (KING_TABLE, KING_ENDGAME_TABLE)}
+
+# Pawn structure terms, which only depend on where the pawns are (see pawns.py)
+DOUBLED_PAWN_PENALTY = 15  # Per pawn beyond the first on a file
+ISOLATED_PAWN_PENALTY = 10  # Per pawn with no friendly pawn on the files next to it
+PASSED_PAWN_BONUS = (0, 60, 40, 25, 15, 10, 5, 0)  # By row for white (row 1 is the 7th rank), mirrored for black
+PASSED_PAWN_KING_DISTANCE = 5  # Endgame, per square the own king is nearer than the enemy's to a passer's path
+
+# Game phase: 24 with all minor and major pieces on the board, 0 with none; the eval blends towards the endgame
+PHASE_WEIGHTS = {PAWN: 0, KNIGHT: 1, BISHOP: 1, ROOK: 2, QUEEN: 4, KING: 0}
+MAX_PHASE = 24
+
+def buildScoreTables(phase):
+    """SCORE[piece code][mailbox square]: signed value plus table bonus of that piece on that square for one phase
+    (0 middlegame, 1 endgame). Black reads the tables mirrored top to bottom."""
+    tables = [None] * (BLACK | KING + 1)
+    for pieceType, pieceTables in PIECE_SQUARE_TABLES.items():
+        value, table = PIECE_VALUES[pieceType][phase], pieceTables[phase]
+        white, black = [0] * 120, [0] * 120
+        for row in range(8):
+            for col in range(8):
+                white[squareIndex(row, col)] = value + table[row * 8 + col]
+                black[squareIndex(row, col)] = -(value + table[(7 - row) * 8 + col])
+        tables[WHITE | pieceType], tables[BLACK | pieceType] = white, black
+    return tables
+
+MIDDLEGAME_SCORES = buildScoreTables(0)
+ENDGAME_SCORES = buildScoreTables(1)
+PHASE = [PHASE_WEIGHTS.get(code & PIECE_TYPE, 0) for code in range(BLACK | KING + 1)]  # By piece code
+
+def taperedScore(middlegame, endgame, phase):
+    """Blends the middlegame and endgame scores by the remaining material"""
+    phase = min(phase, MAX_PHASE)  # Promotions can push it past the starting material
+    return (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
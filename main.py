@@ -1,13 +1,16 @@
+import threading
+import traceback
 import pygame as p
 import computer
 from engine import GameState
-from moves import MoveGenerator, Move
+from moves import MoveGenerator, Move, squareIndex, PIECE_NAMES, PROMOTION_PIECES, EMPTY
 
 WIDTH = HEIGHT = 480
 SIDEBAR_WIDTH = 200
 DIMENSION = 8  # Chess board is 8x8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 60  # For animations later on
+PONDER = True  # Hard level: search the human's expected reply while they think
 IMAGES = {}
 BACKGROUND_IMAGE = p.image.load('background.jpg')
 BACKGROUND_IMAGE = p.transform.scale(BACKGROUND_IMAGE, (WIDTH, HEIGHT))
@@ -36,6 +39,11 @@ class ChessGame:
         self.selectedPieceMoves = []  # Store valid moves for the selected piece
         self.capturedPieces = {"w": [], "b": []}  # Store captured pieces
         self.playerOne, self.playerTwo = None, None
+        self.aiThread = None  # Background search for the computer's move, None when it isn't thinking
+        self.aiMove = None  # Set by the background search when it is done
+        self.ponderThread = None  # Background search of the position after ponderMove, during the human's turn
+        self.ponderMove = None  # The human's reply the computer expects
+        self.searchEngine = computer.SearchEngine()  # The hard level's search, its tables kept from move to move
 
     def loadImages(self):
         pieces = ["wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK"]
@@ -73,14 +81,19 @@ class ChessGame:
             humanTurn = (self.gs.whiteToMove and self.playerOne) or (not self.gs.whiteToMove and self.playerTwo)
             for e in p.event.get():
                 if e.type == p.QUIT:
+                    self.cancelAIMove()
+                    self.cancelPondering()
                     running = False
                 elif e.type == p.MOUSEBUTTONDOWN:
                     if humanTurn:
                         self.handleMouseClick(e)
                 elif e.type == p.KEYDOWN:
                     self.handleKeyPress(e)
-            if not humanTurn:
-                self.handleAIMove()
+            if not humanTurn and running:
+                if self.aiThread is None:
+                    self.startAIMove()
+                elif not self.aiThread.is_alive():
+                    self.handleAIMove()
             if self.moveMade:
                 self.validMoves = self.gs.getValidMoves()
                 self.moveMade = False
@@ -104,22 +117,24 @@ class ChessGame:
                 self.playerClicks.append(self.sqSelected)  # Append for both 1st and 2nd clicks
                 self.selectedPieceMoves = [move for move in self.validMoves if move.startRow == row and move.startCol == col]
             if len(self.playerClicks) == 2:  # After the 2nd click
-                move = Move(self.playerClicks[0], self.playerClicks[1], self.gs.board)
+                move = Move(squareIndex(*self.playerClicks[0]), squareIndex(*self.playerClicks[1]))
                 print(move.getChessNotation())
                 for i in range(len(self.validMoves)):
-                    if move == self.validMoves[i]:
+                    if move.startSq == self.validMoves[i].startSq and move.endSq == self.validMoves[i].endSq:
+                        move = self.validMoves[i]
                         if move.isPawnPromotion:
                             choice = self.showPromotionChoices(self.gs.whiteToMove)
-                            self.gs.makeMove(self.validMoves[i], choice)
-                        else:
-                            self.gs.makeMove(self.validMoves[i])
+                            move = Move(move.startSq, move.endSq, 0, PROMOTION_PIECES[choice])
+                        pieceMoved, pieceCaptured = self.gs.mailbox[move.startSq], self.gs.capturedPiece(move)
+                        self.gs.makeMove(move)
 
                     # Update captured pieces before animating
-                        if move.pieceCaptured != "--":
-                            self.capturedPieces[move.pieceCaptured[0]].append(move.pieceCaptured)
+                        if pieceCaptured != EMPTY:
+                            capturedName = PIECE_NAMES[pieceCaptured]
+                            self.capturedPieces[capturedName[0]].append(capturedName)
 
                     # Call the animateMove function to animate the move
-                        self.animateMove(self.playerClicks[0], self.playerClicks[1], move.pieceMoved)
+                        self.animateMove(self.playerClicks[0], self.playerClicks[1], PIECE_NAMES[pieceMoved])
 
                         self.moveMade = True
                         self.sqSelected = None  # Reset user clicks
@@ -127,7 +142,7 @@ class ChessGame:
                         self.selectedPieceMoves = []  # Clear valid moves for the selected piece
 
                     # Play sounds after move
-                        if move.pieceCaptured != "--":
+                        if pieceCaptured != EMPTY:
                             p.mixer.Sound('sounds_capture.mp3').play()
                         else:
                             p.mixer.Sound('sounds_move-self.mp3').play()
@@ -137,6 +152,8 @@ class ChessGame:
 
     def handleKeyPress(self, event):
         if event.key == p.K_z:
+            self.cancelAIMove()
+            self.cancelPondering()
             self.gs.undoMove()
             self.moveMade = True
         if event.key == p.K_r:
@@ -208,31 +225,117 @@ class ChessGame:
                     elif hardButton.collidepoint(location):
                         return "hard"
 
-    def handleAIMove(self):
+    def copyGame(self):
+        gs = GameState(self.gs.startFen)
+        for move in self.gs.moveLog:
+            gs.makeMove(move)
+        return gs
+
+    def startAIMove(self):
+        if self.ponderThread is not None:
+            if self.gs.moveLog and self.gs.moveLog[-1] == self.ponderMove:
+                # Ponder hit: the search already running is on this position, give it the normal time budget
+                while self.ponderThread.is_alive() and not self.searchEngine.ponderHit(timeout=0.01):
+                    pass  # Its search hasn't started yet, or it answered without searching and is about to end
+                self.aiThread, self.ponderThread, self.ponderMove = self.ponderThread, None, None
+                return
+            self.cancelPondering()  # Ponder miss: throw the work away
+        # Search on a copy of the game in a background thread, so the window keeps drawing and handling events
+        self.aiMove = None
+        self.aiThread = threading.Thread(target=self.searchAIMove, args=(self.copyGame(),), daemon=True)
+        self.aiThread.start()
+
+    def startPondering(self):
+        # Predict the human's reply from the principal variation of the move just played (or the transposition
+        # table), then search the position after it until the human moves
+        pv = self.searchEngine.info.get("pv", [])
+        gs = self.copyGame()
+        validMoves = gs.getValidMoves()
+        prediction = pv[1] if len(pv) > 1 and pv[0] == self.gs.moveLog[-1] else None
+        if prediction is None:
+            entry = self.searchEngine.transpositionTable.probe(gs.zobristKey)
+            prediction = Move.fromID(entry[3]) if entry is not None else None
+        if prediction not in validMoves:
+            return
+        gs.makeMove(prediction)
+        if not gs.getValidMoves():
+            return  # The prediction ends the game, there is nothing to answer
+        self.aiMove = None
+        self.ponderMove = prediction
+        self.ponderThread = threading.Thread(target=self.searchAIMove, args=(gs, True), daemon=True)
+        self.ponderThread.start()
+
+    def searchAIMove(self, gs, ponder=False):
+        validMoves = gs.getValidMoves()
         # Select AI move based on the difficulty level
-        if self.difficulty == "easy":
-            AIMove = computer.findRandomMove(self.validMoves)
-        elif self.difficulty == "medium":
-            AIMove = computer.findBestMove(self.gs, self.validMoves)
-        else:  # Hard
-            AIMove = computer.findBestMoveAlphaBeta(self.gs, self.validMoves)
+        try:
+            if self.difficulty == "easy":
+                AIMove = computer.findRandomMove(validMoves)
+            elif self.difficulty == "medium":
+                AIMove = computer.findBestMove(gs, validMoves)
+            elif ponder:  # No time limit until the human's move shows whether the prediction was right
+                AIMove = self.searchEngine.search(gs, validMoves, timeLimit=None, workers=1).move
+            else:  # Hard
+                AIMove = self.searchEngine.search(gs, validMoves).move
+        except Exception:  # A failed search must not leave the game waiting for a move that never comes
+            traceback.print_exc()
+            AIMove = None
 
     # Fallback to a random move if no move was found
         if AIMove is None:
+            AIMove = computer.findRandomMove(validMoves)
+        self.aiMove = AIMove
+
+    def cancelAIMove(self):
+        # Stop a running search and throw its move away; the hard level stops within a few thousand nodes
+        if self.aiThread is None:
+            return
+        while self.aiThread.is_alive():
+            self.searchEngine.stop()  # Again until it ends, in case the search hadn't started when it was first asked
+            self.aiThread.join(0.01)
+        self.aiThread = None
+        self.aiMove = None
+
+    def cancelPondering(self):
+        if self.ponderThread is None:
+            return
+        while self.ponderThread.is_alive():
+            self.searchEngine.stop()
+            self.ponderThread.join(0.01)
+        self.ponderThread = None
+        self.ponderMove = None
+        self.aiMove = None
+
+    def handleAIMove(self):
+        # The background search is done: make its move
+        AIMove = self.aiMove
+        self.aiThread = None
+        self.aiMove = None
+        if AIMove is None:  # The search thread died before setting its move
+            if not self.validMoves:
+                return
             AIMove = computer.findRandomMove(self.validMoves)
-    
+
     # Make the AI move and update game state
+        pieceCaptured = self.gs.capturedPiece(AIMove)
         self.gs.makeMove(AIMove)
         self.moveMade = True
 
     # Update captured pieces and play the appropriate sound
-        if AIMove.pieceCaptured != "--":
-            self.capturedPieces[AIMove.pieceCaptured[0]].append(AIMove.pieceCaptured)
+        if pieceCaptured != EMPTY:
+            capturedName = PIECE_NAMES[pieceCaptured]
+            self.capturedPieces[capturedName[0]].append(capturedName)
             p.mixer.Sound('sounds_capture.mp3').play()
         else:
             p.mixer.Sound('sounds_move-self.mp3').play()
 
+        humanTurn = (self.gs.whiteToMove and self.playerOne) or (not self.gs.whiteToMove and self.playerTwo)
+        if PONDER and self.difficulty == "hard" and humanTurn:
+            self.startPondering()
+
     def resetGame(self):
+        self.cancelAIMove()
+        self.cancelPondering()
         self.gs = GameState()
         self.validMoves = self.gs.getValidMoves()
         self.sqSelected = None
@@ -269,8 +372,8 @@ class ChessGame:
                     color = moveColor
 
             # Highlight the king in check
-                if self.gs.inCheck and ((self.gs.whiteToMove and (r, c) == self.gs.whiteKingLocation) or
-                                        (not self.gs.whiteToMove and (r, c) == self.gs.blackKingLocation)):
+                if self.gs.inCheck and ((self.gs.whiteToMove and squareIndex(r, c) == self.gs.whiteKingLocation) or
+                                        (not self.gs.whiteToMove and squareIndex(r, c) == self.gs.blackKingLocation)):
                     color = checkColor
 
             # Draw the square
@@ -333,6 +436,18 @@ class ChessGame:
                     yOffset += pieceSize + 5
             if color == "w":
                 yOffset += 40  # Space between white and black sections
+
+    # Show that the computer is thinking (or pondering the move it expects), with the hard level's search progress
+        if self.aiThread is not None or self.ponderThread is not None:
+            lines = ["Thinking..." if self.aiThread is not None else f"Pondering {self.ponderMove.getChessNotation()}..."]
+            if self.difficulty == "hard":
+                depth, nodes = self.searchEngine.progress()
+                lines.append(f"depth {depth}, {nodes} nodes")
+            thinkingFont = p.font.SysFont("Helvetica", 16, True, False)
+            for i, text in enumerate(lines):
+                thinkingLabel = thinkingFont.render(text, True, p.Color("#F1E6D1"))
+                thinkingRect = thinkingLabel.get_rect(center=(WIDTH + SIDEBAR_WIDTH // 2, HEIGHT - 45 + i * 22))
+                self.screen.blit(thinkingLabel, thinkingRect)
    
     def animateMove(self, startSq, endSq, piece):
         startX, startY = startSq[1] * SQ_SIZE, startSq[0] * SQ_SIZE
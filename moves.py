@@ -1,219 +1,355 @@
+# Piece codes for the 10x12 mailbox board: colour bit | piece type, with a sentinel for the border squares
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE, BLACK = 8, 16
+OFFBOARD = 32
+PIECE_TYPE = 7
+PIECE_COLOR = WHITE | BLACK
+
+PIECE_CODES = {"--": EMPTY}
+for colorCode, colorName in ((WHITE, "w"), (BLACK, "b")):
+    for pieceType, pieceName in ((PAWN, "p"), (KNIGHT, "N"), (BISHOP, "B"), (ROOK, "R"), (QUEEN, "Q"), (KING, "K")):
+        PIECE_CODES[colorName + pieceName] = colorCode | pieceType
+PIECE_NAMES = {code: name for name, code in PIECE_CODES.items()}
+PIECE_NAMES[OFFBOARD] = "xx"
+
+# Mailbox square index <-> (row, column); row 0 is the 8th rank like the UI board
+SQUARE_ROW = [sq // 10 - 2 if 21 <= sq <= 98 and 1 <= sq % 10 <= 8 else -1 for sq in range(120)]
+SQUARE_COL = [sq % 10 - 1 if SQUARE_ROW[sq] != -1 else -1 for sq in range(120)]
+BOARD_SQUARES = [sq for sq in range(120) if SQUARE_ROW[sq] != -1]
+CASTLE_WKS, CASTLE_BKS, CASTLE_WQS, CASTLE_BQS = 1, 2, 4, 8  # Castling rights bits
+ALL_CASTLE_RIGHTS = 15
+NO_SQUARE = 0  # Always off the board, used for "no en passant square"
+
+# Move flags, see Move
+PROMOTION_MASK = PIECE_TYPE << 14
+ENPASSANT_FLAG = 1 << 17
+CASTLE_FLAG = 1 << 18
+SQUARES_MASK = (1 << 14) - 1  # Start and end squares of a moveID, e.g. to index a from/to table
+TACTICAL_MOVES, QUIET_MOVES = 1, 2  # Move kinds the generators can be asked for
+ALL_MOVES = TACTICAL_MOVES | QUIET_MOVES
+PROMOTION_PIECES = {"Q": QUEEN, "R": ROOK, "B": BISHOP, "N": KNIGHT}  # Promotion choice letter -> piece type
+
+def squareIndex(row, col):
+    return 21 + row * 10 + col
+
+# Directions are mailbox offsets: -10 is one row up (towards black), +1 is one column right
+ORTHOGONAL_DIRECTIONS = (-10, -1, 10, 1)
+DIAGONAL_DIRECTIONS = (-11, -9, 9, 11)
+KNIGHT_OFFSETS = (-21, -19, -12, -8, 8, 12, 19, 21)
+KING_OFFSETS = (-11, -10, -9, -1, 1, 9, 10, 11)
+
+def buildTargets(offsets):
+    """For every square, the on-board squares one step away by each offset"""
+    return [tuple(sq + m for m in offsets if SQUARE_ROW[sq + m] != -1) if SQUARE_ROW[sq] != -1 else ()
+            for sq in range(120)]
+
+def buildRays(directions):
+    """For every square, (direction, squares walked until the edge) for each direction that leaves the square"""
+    rays = [() for _ in range(120)]
+    for sq in BOARD_SQUARES:
+        squareRays = []
+        for d in directions:
+            ray = []
+            endSq = sq + d
+            while SQUARE_ROW[endSq] != -1:
+                ray.append(endSq)
+                endSq += d
+            if ray:
+                squareRays.append((d, tuple(ray)))
+        rays[sq] = tuple(squareRays)
+    return rays
+
+# Move tables built once at import, indexed by mailbox square
+KNIGHT_TARGETS = buildTargets(KNIGHT_OFFSETS)
+KING_TARGETS = buildTargets(KING_OFFSETS)
+ORTHOGONAL_RAYS = buildRays(ORTHOGONAL_DIRECTIONS)
+DIAGONAL_RAYS = buildRays(DIAGONAL_DIRECTIONS)
+# (direction, target) pawn captures per colour. Read the other way round, PAWN_CAPTURES[WHITE][sq] are also
+# the squares a black pawn must stand on to attack sq
+PAWN_CAPTURES = {color: [tuple((d, sq + d) for d in directions if SQUARE_ROW[sq + d] != -1)
+                         if SQUARE_ROW[sq] != -1 else () for sq in range(120)]
+                 for color, directions in ((WHITE, (-11, -9)), (BLACK, (9, 11)))}
+
+def buildBetween():
+    """BETWEEN[a][b] is the tuple of squares strictly between a and b when they share a rank, file or diagonal"""
+    between = [{} for _ in range(120)]
+    for sq in BOARD_SQUARES:
+        for d, ray in ORTHOGONAL_RAYS[sq] + DIAGONAL_RAYS[sq]:
+            for i, endSq in enumerate(ray):
+                between[sq][endSq] = ray[:i]
+    return between
+
+BETWEEN = buildBetween()
+
+def emptyMailbox():
+    board = bytearray([OFFBOARD]) * 120
+    for sq in BOARD_SQUARES:
+        board[sq] = EMPTY
+    return board
+
+class BoardView:
+    """Read-only board[row][col] view of the mailbox using the two-character piece names, for the UI"""
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def __getitem__(self, row):
+        start = 21 + row * 10
+        return [PIECE_NAMES[piece] for piece in self.mailbox[start:start + 8]]
+
+    def __len__(self):
+        return 8
+
+    def __iter__(self):
+        return (self[row] for row in range(8))
+
 class MoveGenerator:
-    
-    def getPawnMoves(self, r, c, moves, board, whiteToMove):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        
+    """The piece generators take kinds, TACTICAL_MOVES (captures and promotions), QUIET_MOVES or ALL_MOVES,
+    so staged generation can ask for the tactical moves first and the quiet ones only if it needs them."""
+
+    def getPawnMoves(self, sq, moves, board, whiteToMove, kinds=ALL_MOVES):
+        pinDirection = self.pins[sq]  # 0 if the piece is not pinned
+
         if whiteToMove:
-            if board[r - 1][c] == "--":  # 1 square move
-                if not piecePinned or pinDirection == (-1, 0):
-                    moves.append(Move((r, c), (r - 1, c), board))
-                    if r == 6 and board[r-2][c] == "--":  # 2 square move
-                        moves.append(Move((r, c), (r - 2, c), board))
-            if c - 1 >= 0:  # Capture to the left
-                if board[r - 1][c - 1][0] == "b":
-                    if not piecePinned or pinDirection == (-1, -1):
-                        moves.append(Move((r, c), (r - 1, c - 1), board))
-                elif (r - 1, c - 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r - 1, c - 1), board, isEnpassantMove=True))
-            if c + 1 < len(board):  # Capture to the right
-                if board[r - 1][c + 1][0] == "b":
-                    if not piecePinned or pinDirection == (-1, 1):
-                        moves.append(Move((r, c), (r - 1, c + 1), board))
-                elif (r - 1, c + 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r - 1, c + 1), board, isEnpassantMove=True))        
-                
+            forward, startRow, opponent = -10, 6, BLACK
         else:
-            if board[r + 1][c] == "--":  # 1 square move
-                if not piecePinned or pinDirection == (1, 0):
-                    moves.append(Move((r, c), (r + 1, c), board))
-                    if r == 1 and board[r+2][c] == "--":  # 2 square move
-                        moves.append(Move((r, c), (r + 2, c), board))
-            if c - 1 >= 0:  # Capture to the left
-                if board[r + 1][c - 1][0] == "w":
-                    if not piecePinned or pinDirection == (1, -1):
-                        moves.append(Move((r, c), (r + 1, c - 1), board))
-                elif (r + 1, c - 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r + 1, c - 1), board, isEnpassantMove=True))
-            if c + 1 < len(board):  # Capture to the right
-                if board[r + 1][c + 1][0] == "w":
-                    if not piecePinned or pinDirection == (1, 1):
-                        moves.append(Move((r, c), (r + 1, c + 1), board))
-                elif (r + 1, c + 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r + 1, c + 1), board, isEnpassantMove=True))
-              
-    def getRookMoves(self, r, c, moves, board, whiteToMove):
-        """Gets all rook moves for the rook located at (r, c) and adds moves to move log"""
-        opponent = 'b' if whiteToMove else 'w'
-
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if board[r][c][1] != 'Q':  # Can't remove queen from pin on rook moves (only bishop moves)
-                    self.pins.remove(self.pins[i])
-                break
-
-        directions = [(-1, 0), (0, -1), (1, 0), (0, 1)]  # Tuples indicate (row, column) movements possible
-        for d in directions:
-            for i in range(1, len(board)):
-                endRow = r + d[0] * i  # Potentially moves up/down to 7 rows
-                endCol = c + d[1] * i  # Potentially moves up/down to 7 columns
-                if 0 <= endRow < len(board) and 0 <= endCol < len(board[0]):  # Makes sure on the board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = board[endRow][endCol]
-                        if endPiece == '--':  # Valid move to empty space
-                            moves.append(Move((r, c), (endRow, endCol), board))
-                        elif endPiece[0] == opponent:  # Valid move to capture
-                            moves.append(Move((r, c), (endRow, endCol), board))
-                            break
-                        else:  # Cannot take friendly piece
-                            break
-                else:  # Cannot move off board
-                    break
-
-    def getKnightMoves(self, r, c, moves, board, whiteToMove):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))  # L-shaped moves
-        allyColor = "w" if whiteToMove else "b"
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < len(board) and 0 <= endCol < len(board[0]):
-                if not piecePinned or pinDirection == (m[0], m[1]) or pinDirection == (-m[0], -m[1]):
-                    endPiece = board[endRow][endCol]
-                    if endPiece == "--" or endPiece[0] != allyColor:
-                        moves.append(Move((r, c), (endRow, endCol), board))
-        
-    def getBishopMoves(self, r, c, moves, board, whiteToMove):
-        """Gets all bishop moves for the bishop located at (r, c) and adds moves to move log"""
-        opponent = 'b' if whiteToMove else 'w'
-
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        directions = [(-1, -1), (-1, 1), (1, 1), (1, -1)]  # Tuples indicate (row, column) movements possible
-        for d in directions:
-            for i in range(1, len(board)):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-
-                if 0 <= endRow < len(board) and 0 <= endCol < len(board[0]):  # Makes sure on the board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = board[endRow][endCol]
-                        if endPiece == '--':  # Valid move to empty space
-                            moves.append(Move((r, c), (endRow, endCol), board))
-                        elif endPiece[0] == opponent:  # Valid move to capture
-                            moves.append(Move((r, c), (endRow, endCol), board))
-                            break
-                        else:  # Cannot take friendly piece
-                            break
-                else:  # Cannot move off board
-                    break
-        
-    def getQueenMoves(self, r, c, moves, board, whiteToMove):
-        self.getRookMoves(r, c, moves, board, whiteToMove)
-        self.getBishopMoves(r, c, moves, board, whiteToMove)
-
-    def getKingMoves(self, r, c, moves, board, whiteToMove):
-        kingMoves = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))  # All possible king moves
-        allyColor = "w" if whiteToMove else "b"
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                self.pins.remove(self.pins[i])
-                break
-        for m in kingMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < len(board) and 0 <= endCol < len(board[0]):
-                endPiece = board[endRow][endCol]
-                if endPiece == "--" or endPiece[0] != allyColor:
-                    # Place king on end square and check for checks
-                    if whiteToMove:
-                        self.whiteKingLocation = (endRow, endCol)
+            forward, startRow, opponent = 10, 1, WHITE
+
+        promotion = SQUARE_ROW[sq] == 7 - startRow  # Next step reaches the last row
+        endSq = sq + forward
+        if board[endSq] == EMPTY:  # 1 square move
+            if not pinDirection or pinDirection == forward or pinDirection == -forward:
+                if promotion:
+                    if kinds & TACTICAL_MOVES:
+                        for piece in PROMOTION_PIECES.values():
+                            moves.append(Move(sq, endSq, 0, piece))
+                elif kinds & QUIET_MOVES:
+                    moves.append(Move(sq, endSq))
+                    if SQUARE_ROW[sq] == startRow and board[endSq + forward] == EMPTY:  # 2 square move
+                        moves.append(Move(sq, endSq + forward))
+        if not kinds & TACTICAL_MOVES:
+            return
+        for d, endSq in PAWN_CAPTURES[WHITE if whiteToMove else BLACK][sq]:  # Captures to the left and right
+            if not pinDirection or pinDirection == d or pinDirection == -d:
+                if board[endSq] & opponent:
+                    if promotion:
+                        for piece in PROMOTION_PIECES.values():
+                            moves.append(Move(sq, endSq, 0, piece))
                     else:
-                        self.blackKingLocation = (endRow, endCol)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((r, c), (endRow, endCol), board))
-                    # Place king back on original location
-                    if whiteToMove:
-                        self.whiteKingLocation = (r, c)
+                        moves.append(Move(sq, endSq))
+                elif endSq == self.enpassantPossible and not self.enpassantExposesKing(sq, endSq, board):
+                    moves.append(Move(sq, endSq, ENPASSANT_FLAG))
+
+    def enpassantExposesKing(self, sq, endSq, board):
+        """En passant empties two squares of one rank at once, which the pin list can't describe, so try it"""
+        capturedSq = sq - SQUARE_COL[sq] + SQUARE_COL[endSq]
+        pawn, capturedPawn = board[sq], board[capturedSq]
+        board[sq], board[capturedSq], board[endSq] = EMPTY, EMPTY, pawn
+        inCheck = self.checkForPinsAndChecks()[0]
+        board[sq], board[capturedSq], board[endSq] = pawn, capturedPawn, EMPTY
+        return inCheck
+
+    def getRookMoves(self, sq, moves, board, whiteToMove, kinds=ALL_MOVES):
+        """Gets all rook moves for the rook located at sq and adds moves to move log"""
+        opponent = BLACK if whiteToMove else WHITE
+        quiets, captures = kinds & QUIET_MOVES, kinds & TACTICAL_MOVES
+
+        pinDirection = self.pins[sq]  # 0 if the piece is not pinned
+
+        for d, ray in ORTHOGONAL_RAYS[sq]:
+            if not pinDirection or pinDirection == d or pinDirection == -d:
+                for endSq in ray:
+                    endPiece = board[endSq]
+                    if endPiece == EMPTY:  # Valid move to empty space
+                        if quiets:
+                            moves.append(Move(sq, endSq))
                     else:
-                        self.blackKingLocation = (r, c)
-    
-    def getCastleMoves(self, r, c, moves, board, whiteToMove):
-        if self.squareUnderAttack(r, c):
+                        if captures and endPiece & opponent:  # Valid move to capture
+                            moves.append(Move(sq, endSq))
+                        break  # Cannot move past a piece
+
+    def getKnightMoves(self, sq, moves, board, whiteToMove, kinds=ALL_MOVES):
+        if self.pins[sq]:
+            return  # A pinned knight can never stay on the pin line
+
+        opponent = BLACK if whiteToMove else WHITE
+        quiets, captures = kinds & QUIET_MOVES, kinds & TACTICAL_MOVES
+        for endSq in KNIGHT_TARGETS[sq]:  # L-shaped moves
+            endPiece = board[endSq]
+            if (quiets and endPiece == EMPTY) or (captures and endPiece & opponent):
+                moves.append(Move(sq, endSq))
+
+    def getBishopMoves(self, sq, moves, board, whiteToMove, kinds=ALL_MOVES):
+        """Gets all bishop moves for the bishop located at sq and adds moves to move log"""
+        opponent = BLACK if whiteToMove else WHITE
+        quiets, captures = kinds & QUIET_MOVES, kinds & TACTICAL_MOVES
+
+        pinDirection = self.pins[sq]  # 0 if the piece is not pinned
+
+        for d, ray in DIAGONAL_RAYS[sq]:
+            if not pinDirection or pinDirection == d or pinDirection == -d:
+                for endSq in ray:
+                    endPiece = board[endSq]
+                    if endPiece == EMPTY:  # Valid move to empty space
+                        if quiets:
+                            moves.append(Move(sq, endSq))
+                    else:
+                        if captures and endPiece & opponent:  # Valid move to capture
+                            moves.append(Move(sq, endSq))
+                        break  # Cannot move past a piece
+
+    def getQueenMoves(self, sq, moves, board, whiteToMove, kinds=ALL_MOVES):
+        self.getRookMoves(sq, moves, board, whiteToMove, kinds)
+        self.getBishopMoves(sq, moves, board, whiteToMove, kinds)
+
+    def getKingMoves(self, sq, moves, board, whiteToMove, kinds=ALL_MOVES):
+        opponent = BLACK if whiteToMove else WHITE
+        quiets, captures = kinds & QUIET_MOVES, kinds & TACTICAL_MOVES
+        for endSq in KING_TARGETS[sq]:
+            endPiece = board[endSq]
+            if ((quiets and endPiece == EMPTY) or (captures and endPiece & opponent)) and not self.attackMap[endSq]:
+                moves.append(Move(sq, endSq))
+
+    def getCheckEvasions(self, kingSq, moves, board, whiteToMove):
+        """Legal moves out of check: king moves, and in single check captures of the checker or blocks on the
+        squares between it and the king, generated backwards from those target squares. Pinned pieces can't help."""
+        self.getKingMoves(kingSq, moves, board, whiteToMove)
+        if len(self.checks) != 1:
+            return  # Double check, king must move
+        ally, opponent = (WHITE, BLACK) if whiteToMove else (BLACK, WHITE)
+        pawn, knight = ally | PAWN, ally | KNIGHT
+        forward = -10 if whiteToMove else 10
+        pins = self.pins
+        checkSq = self.checks[0][0]
+        for target in (checkSq,) + BETWEEN[kingSq].get(checkSq, ()):  # Knight and contact checks can only be captured
+            promotion = SQUARE_ROW[target] == (0 if whiteToMove else 7)
+            for sq in KNIGHT_TARGETS[target]:
+                if board[sq] == knight and not pins[sq]:
+                    moves.append(Move(sq, target))
+            for rays, slider in ((ORTHOGONAL_RAYS, ally | ROOK), (DIAGONAL_RAYS, ally | BISHOP)):
+                for d, ray in rays[target]:
+                    for sq in ray:
+                        piece = board[sq]
+                        if piece != EMPTY:
+                            if (piece == slider or piece == ally | QUEEN) and not pins[sq]:
+                                moves.append(Move(sq, target))
+                            break
+            if target == checkSq:
+                pawnSquares = [sq for d, sq in PAWN_CAPTURES[opponent][target]]  # Where our pawn captures from
+            else:
+                pawnSquares = [target - forward]
+                if board[target - forward] == EMPTY and SQUARE_ROW[target] == (4 if whiteToMove else 3):
+                    pawnSquares.append(target - 2 * forward)  # 2 square move
+            for sq in pawnSquares:
+                if board[sq] == pawn and not pins[sq]:
+                    if promotion:
+                        for piece in PROMOTION_PIECES.values():
+                            moves.append(Move(sq, target, 0, piece))
+                    else:
+                        moves.append(Move(sq, target))
+        # A pawn that just moved 2 squares and gives check can also be taken en passant
+        if self.enpassantPossible != NO_SQUARE and checkSq == self.enpassantPossible - forward:
+            for sq in (checkSq - 1, checkSq + 1):
+                if board[sq] == pawn and not pins[sq] and \
+                        not self.enpassantExposesKing(sq, self.enpassantPossible, board):
+                    moves.append(Move(sq, self.enpassantPossible, ENPASSANT_FLAG))
+
+    def getCastleMoves(self, sq, moves, board, whiteToMove):
+        if self.attackMap[sq]:
             return # Can't castle while in check
-        if (self.whiteToMove and self.currentCastleRights.wks) or (not self.whiteToMove and self.currentCastleRights.bks):
-            self.getKingsideCastleMoves(r, c, moves, board, whiteToMove)
-        if (self.whiteToMove and self.currentCastleRights.wqs) or (not self.whiteToMove and self.currentCastleRights.bqs):
-            self.getQueensideCastleMoves(r, c, moves, board, whiteToMove)
-    
-    def getKingsideCastleMoves(self, r, c, moves, board, whiteToMove):
-        if board[r][c+1] == "--" and board[r][c+2] == "--":
-            if not self.squareUnderAttack(r, c+1) and not self.squareUnderAttack(r, c+2):
-                moves.append(Move((r, c), (r, c+2), board, isCastleMove=True))
-    
-    def getQueensideCastleMoves(self, r, c, moves, board, whiteToMove):
-        if board[r][c-1] == "--" and board[r][c-2] == "--" and board[r][c-3] == "--":
-            if not self.squareUnderAttack(r, c-1) and not self.squareUnderAttack(r, c-2):
-                moves.append(Move((r, c), (r, c-2), board, isCastleMove=True))
-                
-    
-class CastleRights:
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks, self.bks, self.wqs, self.bqs = wks, bks, wqs, bqs 
+        if self.castleRights & (CASTLE_WKS if whiteToMove else CASTLE_BKS):
+            self.getKingsideCastleMoves(sq, moves, board, whiteToMove)
+        if self.castleRights & (CASTLE_WQS if whiteToMove else CASTLE_BQS):
+            self.getQueensideCastleMoves(sq, moves, board, whiteToMove)
+
+    def getKingsideCastleMoves(self, sq, moves, board, whiteToMove):
+        if board[sq + 1] == EMPTY and board[sq + 2] == EMPTY:
+            if not self.attackMap[sq + 1] and not self.attackMap[sq + 2]:
+                moves.append(Move(sq, sq + 2, CASTLE_FLAG))
+
+    def getQueensideCastleMoves(self, sq, moves, board, whiteToMove):
+        if board[sq - 1] == EMPTY and board[sq - 2] == EMPTY and board[sq - 3] == EMPTY:
+            if not self.attackMap[sq - 1] and not self.attackMap[sq - 2]:
+                moves.append(Move(sq, sq - 2, CASTLE_FLAG))
+
 
 class Move():
+    """A move packed into one integer, moveID = start | end << 7 | promotion piece type << 14 | flags.
+    The moved and captured pieces are not stored; they are read off the board when the move is made."""
+    __slots__ = ("moveID",)
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
     
-    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.isPawnPromotion = (self.pieceMoved == "wp" and self.endRow == 0) or (self.pieceMoved == "bp" and self.endRow == 7)
-        self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = "wp" if self.pieceMoved == "bp" else "bp"
-        # Castle move
-        self.isCastleMove = isCastleMove
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+    def __init__(self, startSq, endSq, flags=0, promotion=EMPTY):
+        """startSq and endSq are mailbox squares, flags is ENPASSANT_FLAG or CASTLE_FLAG, promotion a piece type"""
+        self.moveID = startSq | endSq << 7 | promotion << 14 | flags
+
+    @classmethod
+    def fromID(cls, moveID):
+        """Rebuilds a move from its moveID, e.g. one kept in the transposition table"""
+        move = cls.__new__(cls)
+        move.moveID = moveID
+        return move
+
+    @property
+    def startSq(self):
+        return self.moveID & 127
+
+    @property
+    def endSq(self):
+        return self.moveID >> 7 & 127
+
+    @property
+    def promotion(self):
+        """Piece type a promoting pawn becomes, EMPTY for other moves"""
+        return self.moveID >> 14 & PIECE_TYPE
+
+    @property
+    def isPawnPromotion(self):
+        return self.moveID & PROMOTION_MASK != 0
+
+    @property
+    def isEnpassantMove(self):
+        return self.moveID & ENPASSANT_FLAG != 0
+
+    @property
+    def isCastleMove(self):
+        return self.moveID & CASTLE_FLAG != 0
+
+    @property
+    def startRow(self):
+        return SQUARE_ROW[self.moveID & 127]
+
+    @property
+    def startCol(self):
+        return SQUARE_COL[self.moveID & 127]
+
+    @property
+    def endRow(self):
+        return SQUARE_ROW[self.moveID >> 7 & 127]
+
+    @property
+    def endCol(self):
+        return SQUARE_COL[self.moveID >> 7 & 127]
         
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.moveID == other.moveID
+        return NotImplemented
+
+    def __hash__(self):
+        return self.moveID
+
+    def __repr__(self):
+        return "Move(%s)" % self.getChessNotation()
         
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
     
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
\ No newline at end of file
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += PIECE_NAMES[WHITE | self.promotion][1].lower()
+        return notation
@@ -0,0 +1,101 @@
+"""Pawn structure evaluation and the pawn hash table that caches it, keyed by GameState.pawnKey"""
+from array import array
+from moves import BOARD_SQUARES, SQUARE_ROW, SQUARE_COL, WHITE, BLACK, PAWN
+from evaluation import (DOUBLED_PAWN_PENALTY, ISOLATED_PAWN_PENALTY, PASSED_PAWN_BONUS, PASSED_PAWN_KING_DISTANCE,
+                        MAX_PHASE)
+
+ENTRY_BYTES = 28  # 8 byte key + 4 byte score + two 8 byte passed pawn masks
+WHITE_PAWN, BLACK_PAWN = WHITE | PAWN, BLACK | PAWN
+
+def evaluatePawns(board):
+    """(score, white passed pawns, black passed pawns) of the pawns on the mailbox board. The score is the doubled,
+    isolated and passed pawn terms in centipawns for white; the masks have bit row * 8 + col set (a8 is bit 0)."""
+    whiteRows, blackRows = [[] for _ in range(8)], [[] for _ in range(8)]  # Rows of each side's pawns, by file
+    for i, sq in enumerate(BOARD_SQUARES):
+        piece = board[sq]
+        if piece == WHITE_PAWN:
+            whiteRows[i & 7].append(i >> 3)
+        elif piece == BLACK_PAWN:
+            blackRows[i & 7].append(i >> 3)
+    score, whitePassed, blackPassed = 0, 0, 0
+    for col in range(8):
+        neighbours = range(max(col - 1, 0), min(col + 2, 8))
+        for rows, sign in ((whiteRows, 1), (blackRows, -1)):
+            if len(rows[col]) > 1:
+                score -= sign * DOUBLED_PAWN_PENALTY * (len(rows[col]) - 1)
+            if rows[col] and not any(rows[file] for file in neighbours if file != col):
+                score -= sign * ISOLATED_PAWN_PENALTY * len(rows[col])
+        # Passed: no enemy pawn ahead on its own or the next files
+        blackFront = min((row for file in neighbours for row in blackRows[file]), default=8)
+        for row in whiteRows[col]:
+            if blackFront >= row:
+                score += PASSED_PAWN_BONUS[row]
+                whitePassed |= 1 << (row * 8 + col)
+        whiteBack = max((row for file in neighbours for row in whiteRows[file]), default=-1)
+        for row in blackRows[col]:
+            if whiteBack <= row:
+                score -= PASSED_PAWN_BONUS[7 - row]
+                blackPassed |= 1 << (row * 8 + col)
+    return score, whitePassed, blackPassed
+
+def passedPawnKingScore(gs, whitePassed, blackPassed):
+    """Endgame term of the passed pawns that depends on the kings, so can't be cached with the pawns: for each
+    passer, how much nearer its own king is than the enemy king to the square in front of it. For white."""
+    kings = ((SQUARE_ROW[gs.whiteKingLocation], SQUARE_COL[gs.whiteKingLocation]),
+             (SQUARE_ROW[gs.blackKingLocation], SQUARE_COL[gs.blackKingLocation]))
+    score = 0
+    for passed, (ownRow, ownCol), (enemyRow, enemyCol), step, sign in \
+            ((whitePassed, kings[0], kings[1], -1, 1), (blackPassed, kings[1], kings[0], 1, -1)):
+        while passed:
+            bit = passed & -passed
+            passed ^= bit
+            square = bit.bit_length() - 1
+            row, col = (square >> 3) + step, square & 7
+            score += sign * (max(abs(enemyRow - row), abs(enemyCol - col)) - max(abs(ownRow - row), abs(ownCol - col)))
+    return score * PASSED_PAWN_KING_DISTANCE * (MAX_PHASE - min(gs.phase, MAX_PHASE)) // MAX_PHASE
+
+class PawnHashTable:
+    """One entry per slot, always replaced. Pawn structures repeat across most of the tree (only pawn moves and
+    pawn captures change them), so a small table catches nearly every lookup."""
+
+    def __init__(self, sizeKB=256):
+        slots = 1
+        while slots * 2 * ENTRY_BYTES <= sizeKB * 1024:
+            slots *= 2  # Power of two so the slot is the low bits of the key
+        self.mask = slots - 1
+        self.keys = array("Q", bytes(8 * slots))
+        self.scores = array("i", bytes(4 * slots))
+        self.whitePassed = array("Q", bytes(8 * slots))
+        self.blackPassed = array("Q", bytes(8 * slots))
+        self.filled = bytearray(slots)  # A zero key is a real key (no pawns on the board)
+        self.probes = self.hits = 0
+
+    def clear(self):
+        self.filled = bytearray(len(self.filled))
+        self.probes = self.hits = 0
+
+    def lookup(self, gs):
+        """(score, white passed pawns, black passed pawns) of gs's pawns, from the table or evaluated and stored"""
+        self.probes += 1
+        key = gs.pawnKey
+        slot = key & self.mask
+        if self.keys[slot] == key and self.filled[slot]:
+            self.hits += 1
+            return self.scores[slot], self.whitePassed[slot], self.blackPassed[slot]
+        score, whitePassed, blackPassed = evaluatePawns(gs.mailbox)
+        self.keys[slot], self.scores[slot], self.filled[slot] = key, score, 1
+        self.whitePassed[slot], self.blackPassed[slot] = whitePassed, blackPassed
+        return score, whitePassed, blackPassed
+
+    def score(self, gs):
+        """Pawn structure score of gs for white, with the passed pawns' king distance term"""
+        score, whitePassed, blackPassed = self.lookup(gs)
+        if whitePassed or blackPassed:
+            score += passedPawnKingScore(gs, whitePassed, blackPassed)
+        return score
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def stats(self):
+        return {"probes": self.probes, "hits": self.hits, "hitRate": round(self.hitRate(), 3)}
@@ -0,0 +1,201 @@
+"""Headless perft for GameState.getValidMoves: counts the leaf nodes of the legal move tree.
+
+    python perft.py --depth 4                                  # start position
+    python perft.py --fen "<fen>" --depth 3 --divide           # per root move breakdown
+    python perft.py --suite                                    # reference positions, checked and timed
+    python perft.py --suite --save-baseline perft_baseline.json
+    python perft.py --suite --baseline perft_baseline.json     # compare nodes/second with a recorded run
+    python perft.py --movegen-bench                            # time each piece generator on the suite positions
+"""
+import argparse
+import json
+import time
+from engine import GameState, START_FEN
+from moves import BOARD_SQUARES, WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+
+# (name, fen, {depth: nodes}) - the well known perft reference positions and edge cases, with their published counts.
+# Only the deepest count of each edge case is published, so only that one is checked.
+SUITE = [
+    ("start position", START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position 3 (en passant pins)", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position 4 (promotions, castling)", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    ("illegal en passant (discovered check)", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+     {6: 1134888}),
+    ("illegal en passant (diagonal pin)", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+     {6: 1015133}),
+    ("en passant capture checks opponent", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+     {6: 1440467}),
+    ("short castling gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+     {6: 661072}),
+    ("long castling gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1",
+     {6: 803711}),
+    ("castle rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+     {4: 1274206}),
+    ("castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1",
+     {4: 1720476}),
+    ("promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",
+     {6: 3821001}),
+    ("discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1",
+     {5: 1004658}),
+    ("promote to give check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1",
+     {6: 217342}),
+    ("under promote to give check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1",
+     {6: 92683}),
+    ("self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1",
+     {6: 2217}),
+    ("stalemate and checkmate", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1",
+     {7: 567584}),
+    ("stalemate and checkmate 2", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+     {4: 23527}),
+]
+
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth):
+    """Returns {move notation: nodes below it}"""
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getChessNotation()] = perft(gs, depth - 1)
+        gs.undoMove()
+    return counts
+
+
+def timedPerft(fen, depth):
+    gs = GameState(fen)
+    start = time.perf_counter()
+    nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed
+
+
+def runSuite(maxNodes, baseline=None):
+    """Runs every suite position at the deepest reference depth within maxNodes; returns (all passed, results)"""
+    results = {}
+    allPassed = True
+    totalNodes, totalTime = 0, 0.0
+    for name, fen, expected in SUITE:
+        depths = [depth for depth, nodes in expected.items() if nodes <= maxNodes]
+        if not depths:
+            print(f"{name:40} skipped (needs --max-nodes {min(expected.values())})")
+            continue
+        depth = max(depths)
+        nodes, elapsed = timedPerft(fen, depth)
+        passed = nodes == expected[depth]
+        allPassed = allPassed and passed
+        nps = nodes / elapsed if elapsed > 0 else 0.0
+        totalNodes, totalTime = totalNodes + nodes, totalTime + elapsed
+        results[name] = {"depth": depth, "nodes": nodes, "seconds": round(elapsed, 3), "nps": round(nps)}
+        line = f"{name:40} depth {depth}  {nodes:>9} nodes  {'ok' if passed else 'FAIL (expected %d)' % expected[depth]}" \
+               f"  {elapsed:7.2f}s  {nps:>9.0f} nps"
+        if baseline and name in baseline and baseline[name]["depth"] == depth and baseline[name]["nps"]:
+            line += f"  x{nps / baseline[name]['nps']:.2f} vs baseline"
+        print(line)
+    if totalTime > 0:
+        print(f"{'total':40} {totalNodes} nodes in {totalTime:.2f}s, {totalNodes / totalTime:.0f} nps")
+    return allPassed, results
+
+
+def benchGenerators(repeats):
+    """Times every piece move generator, the pin/check detector and the attack queries over the suite positions.
+    Returns {name: microseconds per call}."""
+    timings = {}
+    def record(name, function, calls):
+        if not calls:
+            return
+        start = time.perf_counter()
+        for _ in range(repeats):
+            function()
+        elapsed = time.perf_counter() - start
+        timings.setdefault(name, []).append(elapsed * 1e6 / (repeats * calls))
+
+    for name, fen, expected in SUITE:
+        gs = GameState(fen)
+        board, whiteToMove = gs.mailbox, gs.whiteToMove
+        ally = WHITE if whiteToMove else BLACK
+        inCheck, gs.pins, checks = gs.checkForPinsAndChecks()
+        gs.attackMap = gs.getAttackMap()
+        for pieceType, pieceName in ((PAWN, "pawn"), (KNIGHT, "knight"), (BISHOP, "bishop"), (ROOK, "rook"),
+                                     (QUEEN, "queen"), (KING, "king")):
+            squares = [sq for sq in BOARD_SQUARES if board[sq] == ally | pieceType]
+            generator = gs.moveFunctions[pieceType]
+            def generate():
+                moves = []
+                for sq in squares:
+                    generator(sq, moves, board, whiteToMove)
+            record(pieceName + " moves", generate, len(squares))
+        record("checkForPinsAndChecks", gs.checkForPinsAndChecks, 1)
+        record("getAttackMap", gs.getAttackMap, 1)
+        record("squareUnderAttack", lambda: [gs.squareUnderAttack(sq) for sq in BOARD_SQUARES], 64)
+    return {name: sum(samples) / len(samples) for name, samples in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft node counts and move generator benchmark")
+    parser.add_argument("--fen", default=START_FEN, help="position to search (default: start position)")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print the node count below every root move")
+    parser.add_argument("--suite", action="store_true", help="run the reference position suite")
+    parser.add_argument("--max-nodes", type=int, default=4000000,
+                        help="suite: deepest depth whose expected node count fits in this budget")
+    parser.add_argument("--baseline", help="suite: JSON file from --save-baseline to compare nodes/second with")
+    parser.add_argument("--save-baseline", help="suite: write this run's results to a JSON file")
+    parser.add_argument("--movegen-bench", action="store_true",
+                        help="time each move generator per piece and the attack queries per call")
+    parser.add_argument("--repeats", type=int, default=200, help="movegen-bench: calls per position")
+    args = parser.parse_args()
+
+    if args.movegen_bench:
+        for name, micros in benchGenerators(args.repeats).items():
+            print(f"{name:25} {micros:8.2f} us")
+        return
+
+    if args.suite:
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        allPassed, results = runSuite(args.max_nodes, baseline)
+        if args.save_baseline:
+            with open(args.save_baseline, "w") as f:
+                json.dump(results, f, indent=2)
+        raise SystemExit(0 if allPassed else 1)
+
+    gs = GameState(args.fen)
+    start = time.perf_counter()
+    if args.divide:
+        counts = divide(gs, args.depth)
+        for name in sorted(counts):
+            print(f"{name}: {counts[name]}")
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(gs, args.depth)
+    elapsed = time.perf_counter() - start
+    print(f"\nNodes: {nodes}")
+    print(f"Time: {elapsed:.3f}s ({nodes / elapsed if elapsed > 0 else 0:.0f} nodes/second)")
+
+
+if __name__ == "__main__":
+    main()
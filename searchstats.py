@@ -0,0 +1,132 @@
+"""Profiling hooks for the hard level's search: where the time of each SearchEngine.search goes, and one JSON line
+per search for offline analysis.
+
+    profiler = SearchProfiler("search.jsonl")
+    profiler.enable()     # wraps the GameState, SearchEngine and PawnHashTable methods below
+    ...                   # play or bench as usual, every search writes a record
+    profiler.disable()    # puts the originals back
+
+Nothing is wrapped until enable, so the search runs at full speed without it. While enabled, every GameState and
+SearchEngine is timed, and the timing itself slows the search down, so compare shares rather than seconds. Time
+one search at a time: searches running together in several threads would be charged to each other.
+"""
+import json
+import time
+from computer import SearchEngine
+from engine import GameState
+from pawns import PawnHashTable
+
+# Methods timed, by the category their time is charged to. Time is exclusive: a method called from another timed
+# one is charged to its own category, and whatever is not in a method below is "search".
+TIMED_METHODS = {(GameState, "getValidMoves"): "movegen",
+                 (GameState, "squareUnderAttack"): "attacks",
+                 (GameState, "makeMove"): "makeMove/undoMove", (GameState, "undoMove"): "makeMove/undoMove",
+                 (GameState, "makeNullMove"): "makeMove/undoMove", (GameState, "undoNullMove"): "makeMove/undoMove",
+                 (GameState, "evaluation"): "evaluation", (PawnHashTable, "lookup"): "evaluation"}
+TIMED_GENERATORS = {(GameState, "orderedMoves"): "movegen"}  # Timed per move yielded, as they only run when asked
+CATEGORIES = ("search", "movegen", "attacks", "makeMove/undoMove", "evaluation")
+
+class SearchProfiler:
+
+    def __init__(self, path=None):
+        self.path = path  # JSON lines file the records are appended to, None to only keep them in records
+        self.records = []
+        self.originals = {}
+        self.reset()
+
+    def reset(self):
+        self.seconds = dict.fromkeys(CATEGORIES, 0.0)
+        self.quiescenceNodes = 0
+        self.stack = ["search"]
+        self.mark = time.perf_counter()
+
+    def enter(self, category):
+        now = time.perf_counter()
+        self.seconds[self.stack[-1]] += now - self.mark
+        self.mark = now
+        self.stack.append(category)
+
+    def leave(self):
+        now = time.perf_counter()
+        self.seconds[self.stack.pop()] += now - self.mark
+        self.mark = now
+
+    def timed(self, function, category):
+        def wrapper(*args, **kwargs):
+            self.enter(category)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.leave()
+        return wrapper
+
+    def timedGenerator(self, function, category):
+        def wrapper(*args, **kwargs):
+            generator = function(*args, **kwargs)
+            while True:
+                self.enter(category)
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    self.leave()
+                yield item
+        return wrapper
+
+    def countedQuiescence(self, function):
+        def wrapper(*args, **kwargs):
+            self.quiescenceNodes += 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    def recordedSearch(self, function):
+        def wrapper(engine, gs, validMoves, *args, **kwargs):
+            history = [move.getChessNotation() for move in gs.moveLog]
+            self.reset()
+            start = time.perf_counter()
+            result = function(engine, gs, validMoves, *args, **kwargs)
+            self.seconds["search"] += time.perf_counter() - self.mark
+            self.record(gs.startFen, history, result, time.perf_counter() - start)
+            return result
+        return wrapper
+
+    def enable(self):
+        if self.originals:
+            return
+        for (owner, name), category in TIMED_METHODS.items():
+            self.originals[(owner, name)] = getattr(owner, name)
+            setattr(owner, name, self.timed(getattr(owner, name), category))
+        for (owner, name), category in TIMED_GENERATORS.items():
+            self.originals[(owner, name)] = getattr(owner, name)
+            setattr(owner, name, self.timedGenerator(getattr(owner, name), category))
+        # Methods are looked up at each call, so the recursion goes through the wrappers too
+        self.originals[(SearchEngine, "quiescence")] = SearchEngine.quiescence
+        SearchEngine.quiescence = self.countedQuiescence(SearchEngine.quiescence)
+        self.originals[(SearchEngine, "search")] = SearchEngine.search
+        SearchEngine.search = self.recordedSearch(SearchEngine.search)
+
+    def disable(self):
+        for (owner, name), original in self.originals.items():
+            setattr(owner, name, original)
+        self.originals.clear()
+
+    def record(self, fen, history, result, seconds):
+        """Adds the statistics of the search just finished to records and the JSON lines file"""
+        info = result.info
+        move = result.move
+        record = {"fen": fen, "moves": history, "move": move.getChessNotation() if move is not None else None,
+                  "seconds": round(seconds, 3), "depth": info.get("depth", 0), "score": info.get("score", 0),
+                  "nodes": info.get("nodes", 0), "quiescenceNodes": self.quiescenceNodes,
+                  "nps": round(info.get("nodes", 0) / seconds) if seconds > 0 else 0, "ebf": info.get("ebf", 0.0),
+                  "cutoffHistogram": info.get("cutoffHistogram", []), "ttHitRate": info.get("ttHitRate", 0.0),
+                  "pawnHitRate": info.get("pawnHitRate", 0.0),
+                  "time": {category: round(spent / seconds, 3) if seconds > 0 else 0.0
+                           for category, spent in self.seconds.items()},
+                  "pv": [pvMove.getChessNotation() for pvMove in info.get("pv", [])],
+                  "book": info.get("book", False), "tablebase": info.get("tablebase", False)}
+        self.records.append(record)
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
@@ -0,0 +1,407 @@
+"""Endgame tablebases for up to four pieces, generated here by retrograde analysis and probed memory-mapped.
+
+    python tablebase.py generate KQvK KRvK KPvK      # build the endings (and the smaller ones they turn into)
+    python tablebase.py generate --all 3             # every 3-man ending
+    python tablebase.py probe --fen "<fen>"          # win / draw / loss and distance to mate of a position
+
+A table holds one byte per (side to move, square of each piece): 0 for a draw (or an illegal position), 1..127
+for a win of the side to move in that many plies, 128 + n for a loss in n plies (128 is checkmated). Squares are
+0..63 like the UI board, a8 first. Only the stronger side's material is stored, "KvKP" is read from "KPvK" with
+the colours swapped and the board mirrored. Positions with castling rights or an en passant capture aren't covered.
+"""
+import argparse
+import itertools
+import mmap
+import os
+from moves import (squareIndex, SQUARE_ROW, SQUARE_COL, BOARD_SQUARES, KNIGHT_TARGETS, KING_TARGETS, ORTHOGONAL_RAYS,
+                   DIAGONAL_RAYS, PAWN_CAPTURES, BETWEEN, PIECE_TYPE, EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+                   WHITE, BLACK)
+
+TABLEBASE_DIR = "tablebases"
+MAX_PIECES = 4
+MAX_PLIES = 127
+WIN, DRAW, LOSS = 1, 0, -1
+PIECE_LETTERS = {KING: "K", QUEEN: "Q", ROOK: "R", BISHOP: "B", KNIGHT: "N", PAWN: "P"}
+LETTER_PIECES = {letter: pieceType for pieceType, letter in PIECE_LETTERS.items()}
+PIECE_ORDER = (KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN)  # Order of the pieces within a signature
+PIECE_STRENGTH = {KING: 0, QUEEN: 9, ROOK: 5, BISHOP: 3, KNIGHT: 3, PAWN: 1}
+
+# Move tables on 0..63 squares, taken from the mailbox ones
+TO64 = {sq: SQUARE_ROW[sq] * 8 + SQUARE_COL[sq] for sq in BOARD_SQUARES}
+FROM64 = [squareIndex(sq // 8, sq % 8) for sq in range(64)]
+KING64 = [tuple(TO64[t] for t in KING_TARGETS[FROM64[sq]]) for sq in range(64)]
+KNIGHT64 = [tuple(TO64[t] for t in KNIGHT_TARGETS[FROM64[sq]]) for sq in range(64)]
+ROOK_RAYS64 = [tuple(tuple(TO64[t] for t in ray) for d, ray in ORTHOGONAL_RAYS[FROM64[sq]]) for sq in range(64)]
+BISHOP_RAYS64 = [tuple(tuple(TO64[t] for t in ray) for d, ray in DIAGONAL_RAYS[FROM64[sq]]) for sq in range(64)]
+QUEEN_RAYS64 = [ROOK_RAYS64[sq] + BISHOP_RAYS64[sq] for sq in range(64)]
+SLIDER_RAYS64 = {ROOK: ROOK_RAYS64, BISHOP: BISHOP_RAYS64, QUEEN: QUEEN_RAYS64}
+PAWN_ATTACKS64 = {color: [tuple(TO64[t] for d, t in PAWN_CAPTURES[color][FROM64[sq]]) for sq in range(64)]
+                  for color in (WHITE, BLACK)}
+BETWEEN64 = [{TO64[b]: tuple(TO64[t] for t in squares) for b, squares in BETWEEN[FROM64[a]].items()}
+             for a in range(64)]
+PAWN_STEP = {WHITE: -8, BLACK: 8}  # White pawns move up the board, towards row 0
+PAWN_START_ROW = {WHITE: 6, BLACK: 1}
+PROMOTION_ROW = {WHITE: 0, BLACK: 7}
+
+def attacks(pieceType, color, fromSq, sq, occupied):
+    """Whether the piece on fromSq attacks sq, with occupied the squares holding a piece"""
+    if pieceType == KING:
+        return sq in KING64[fromSq]
+    if pieceType == KNIGHT:
+        return sq in KNIGHT64[fromSq]
+    if pieceType == PAWN:
+        return sq in PAWN_ATTACKS64[color][fromSq]
+    between = BETWEEN64[fromSq].get(sq)
+    if between is None:
+        return False
+    orthogonal = fromSq // 8 == sq // 8 or fromSq % 8 == sq % 8
+    if (pieceType == ROOK and not orthogonal) or (pieceType == BISHOP and orthogonal):
+        return False
+    for betweenSq in between:
+        if betweenSq in occupied:
+            return False
+    return True
+
+def isAttacked(sq, color, pieces, squares):
+    """Whether a piece of color attacks sq; pieces is [(color, piece type)] standing on squares"""
+    occupied = set(squares)
+    for (pieceColor, pieceType), fromSq in zip(pieces, squares):
+        if pieceColor == color and attacks(pieceType, color, fromSq, sq, occupied):
+            return True
+    return False
+
+def pieceMoves(pieceType, color, fromSq, occupied):
+    """Yields the squares a piece can move or capture to, ignoring checks; occupied maps square -> piece number.
+    Pawns only capture diagonally and only push onto empty squares."""
+    if pieceType == KING:
+        yield from KING64[fromSq]
+    elif pieceType == KNIGHT:
+        yield from KNIGHT64[fromSq]
+    elif pieceType == PAWN:
+        step = PAWN_STEP[color]
+        if fromSq + step not in occupied:
+            yield fromSq + step
+            if fromSq // 8 == PAWN_START_ROW[color] and fromSq + 2 * step not in occupied:
+                yield fromSq + 2 * step
+        for sq in PAWN_ATTACKS64[color][fromSq]:
+            if sq in occupied:
+                yield sq
+    else:
+        for ray in SLIDER_RAYS64[pieceType][fromSq]:
+            for sq in ray:
+                yield sq
+                if sq in occupied:
+                    break
+
+def pieceUnmoves(pieceType, color, toSq, occupied):
+    """Yields the empty squares a piece on toSq could have come from without capturing"""
+    if pieceType == KING or pieceType == KNIGHT:
+        for sq in (KING64 if pieceType == KING else KNIGHT64)[toSq]:
+            if sq not in occupied:
+                yield sq
+    elif pieceType == PAWN:
+        step = PAWN_STEP[color]
+        fromSq = toSq - step
+        if fromSq // 8 != PROMOTION_ROW[color] ^ 7 and fromSq not in occupied:  # Not from its own back rank
+            yield fromSq
+            if fromSq // 8 == PAWN_START_ROW[color] + step // 8 and fromSq - step not in occupied:
+                yield fromSq - step
+    else:
+        for ray in SLIDER_RAYS64[pieceType][toSq]:
+            for sq in ray:
+                if sq in occupied:
+                    break
+                yield sq
+
+def signatureOf(pieces):
+    """"KQvK" style name of [(color, piece type)]"""
+    names = {}
+    for color in (WHITE, BLACK):
+        types = sorted((pieceType for pieceColor, pieceType in pieces if pieceColor == color), key=PIECE_ORDER.index)
+        names[color] = "".join(PIECE_LETTERS[pieceType] for pieceType in types)
+    return names[WHITE] + "v" + names[BLACK]
+
+def parseSignature(signature):
+    """[(color, piece type)] of a signature in table order: white's pieces then black's, kings first"""
+    whiteNames, blackNames = signature.upper().split("V")
+    return [(WHITE, LETTER_PIECES[letter]) for letter in whiteNames] + \
+        [(BLACK, LETTER_PIECES[letter]) for letter in blackNames]
+
+def strength(pieces, color):
+    return sorted((PIECE_STRENGTH[pieceType] for pieceColor, pieceType in pieces if pieceColor == color), reverse=True)
+
+def isCanonical(pieces):
+    """Tables are stored for the side with the stronger material as white"""
+    return strength(pieces, WHITE) >= strength(pieces, BLACK)
+
+def insufficientMaterial(pieces):
+    """The same draws as GameState.insufficientMaterial: bare kings, or a lone bishop or knight"""
+    return len(pieces) == 2 or (len(pieces) == 3 and any(pieceType in (BISHOP, KNIGHT) for color, pieceType in pieces))
+
+def decode(value):
+    """(WIN / DRAW / LOSS for the side to move, plies to mate) of a table byte"""
+    if value == 0:
+        return DRAW, 0
+    if value < 128:
+        return WIN, value
+    return LOSS, value - 128
+
+class Tablebase:
+    """The generated tables of a directory, each memory-mapped the first time a position of it is probed"""
+
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.directory = directory
+        self.tables = {}  # Signature -> mmap, or None when there is no file
+
+    def path(self, signature):
+        return os.path.join(self.directory, signature + ".tb")
+
+    def table(self, signature):
+        if signature not in self.tables:
+            self.tables[signature] = None
+            if os.path.exists(self.path(signature)):
+                with open(self.path(signature), "rb") as f:
+                    self.tables[signature] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.tables[signature]
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables.clear()
+
+    def probePieces(self, placed, whiteToMove):
+        """(WIN / DRAW / LOSS, plies) for the side to move, with placed [(color, piece type, square 0..63)];
+        None without a table for the material"""
+        pieces = [(color, pieceType) for color, pieceType, sq in placed]
+        if insufficientMaterial(pieces):
+            return DRAW, 0
+        if not isCanonical(pieces):  # Swap the colours and mirror the board
+            placed = [(color ^ (WHITE | BLACK), pieceType, sq ^ 56) for color, pieceType, sq in placed]
+            pieces = [(color, pieceType) for color, pieceType, sq in placed]
+            whiteToMove = not whiteToMove
+        signature = signatureOf(pieces)
+        table = self.table(signature)
+        if table is None:
+            return None
+        index = 0 if whiteToMove else 1
+        remaining = list(placed)
+        for color, pieceType in parseSignature(signature):
+            for i, (pieceColor, placedType, sq) in enumerate(remaining):
+                if pieceColor == color and placedType == pieceType:
+                    index = index * 64 + sq
+                    del remaining[i]
+                    break
+        return decode(table[index])
+
+    def probe(self, gs):
+        """(WIN / DRAW / LOSS, plies) of a GameState for the side to move, None when it isn't in the tables"""
+        if gs.pieceCount > MAX_PIECES or gs.castleRights or gs.enpassantKey():
+            return None
+        placed = [(gs.mailbox[sq] & (WHITE | BLACK), gs.mailbox[sq] & PIECE_TYPE, TO64[sq]) for sq in BOARD_SQUARES
+                  if gs.mailbox[sq] != EMPTY]
+        return self.probePieces(placed, gs.whiteToMove)
+
+def dependencies(signature):
+    """Signatures a position of this one can turn into by a capture or a promotion"""
+    pieces = parseSignature(signature)
+    children = set()
+    for i, (color, pieceType) in enumerate(pieces):
+        if pieceType == KING:
+            continue
+        captured = pieces[:i] + pieces[i + 1:]
+        if pieceType == PAWN:
+            for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                children.add(tuple(pieces[:i] + [(color, promotion)] + pieces[i + 1:]))
+                for j, other in enumerate(pieces):  # Promoting with a capture
+                    if j != i and other[1] != KING and other[0] != color:
+                        promoted = list(pieces)
+                        promoted[i] = (color, promotion)
+                        children.add(tuple(promoted[:j] + promoted[j + 1:]))
+        children.add(tuple(captured))
+    names = set()
+    for child in children:
+        child = list(child)
+        if not insufficientMaterial(child):
+            if not isCanonical(child):
+                child = [(color ^ (WHITE | BLACK), pieceType) for color, pieceType in child]
+            names.add(signatureOf(child))
+    return names
+
+def generate(signature, tablebase, log=print):
+    """Retrograde analysis of one ending, written to the tablebase's directory. The tables it can turn into must
+    already be there. Positions are resolved a ply at a time outwards from the mates: a position is won once one move
+    reaches a lost one, and lost once every move reaches a won one."""
+    pieces = parseSignature(signature)
+    count = len(pieces)
+    positions = 64 ** count
+    size = 2 * positions
+    colors = (WHITE, BLACK)
+    kings = {color: pieces.index((color, KING)) for color in colors}
+
+    # Pass 1: which positions are legal (no two pieces on a square, no pawn on a back rank, the side that just
+    # moved not in check)
+    legal = bytearray(size)
+    for side, mover in enumerate(colors):
+        other = colors[1 - side]
+        offset = side * positions
+        for index, squares in enumerate(itertools.product(range(64), repeat=count)):
+            if len(set(squares)) < count:
+                continue
+            if any(pieceType == PAWN and squares[i] // 8 in (0, 7) for i, (color, pieceType) in enumerate(pieces)):
+                continue
+            if not isAttacked(squares[kings[other]], mover, pieces, squares):
+                legal[offset + index] = 1
+
+    # Pass 2: count the moves staying in this table, and settle the ones leaving it (captures and promotions)
+    # with the smaller tables
+    movesLeft = bytearray(size)  # Moves to positions of this table not yet known to be won for the opponent
+    canAvoidLoss = bytearray(size)  # A move out of the table draws or wins
+    exitLoss = bytearray(size)  # Longest loss among the moves out of the table
+    wins = [[] for _ in range(MAX_PLIES + 2)]  # Positions won / lost in n plies, waiting to be settled
+    losses = [[] for _ in range(MAX_PLIES + 2)]
+    powers = [64 ** (count - 1 - i) for i in range(count)]
+    for side, mover in enumerate(colors):
+        other = colors[1 - side]
+        offset, childOffset = side * positions, (1 - side) * positions
+        for index, squares in enumerate(itertools.product(range(64), repeat=count)):
+            if not legal[offset + index]:
+                continue
+            occupied = {sq: i for i, sq in enumerate(squares)}
+            legalMoves = 0
+            exits = False
+            for i, (color, pieceType) in enumerate(pieces):
+                if color != mover:
+                    continue
+                fromSq = squares[i]
+                for toSq in pieceMoves(pieceType, color, fromSq, occupied):
+                    captured = occupied.get(toSq)
+                    if captured is not None and pieces[captured][0] == mover:
+                        continue
+                    promotes = pieceType == PAWN and toSq // 8 == PROMOTION_ROW[color]
+                    if captured is None and not promotes:
+                        child = childOffset + index + (toSq - fromSq) * powers[i]
+                        if legal[child]:
+                            movesLeft[offset + index] += 1
+                            legalMoves += 1
+                        continue
+                    # Leaves the table: look the result up in the smaller one
+                    placed = [(pieceColor, placedType, toSq if j == i else sq)
+                              for j, ((pieceColor, placedType), sq) in enumerate(zip(pieces, squares)) if j != captured]
+                    afterPieces = [(pieceColor, placedType) for pieceColor, placedType, sq in placed]
+                    afterSquares = [sq for pieceColor, placedType, sq in placed]
+                    kingSq = squares[kings[mover]] if pieceType != KING else toSq
+                    if isAttacked(kingSq, other, afterPieces, afterSquares):
+                        continue  # Leaves the king in check
+                    legalMoves += 1
+                    exits = True
+                    for promotion in ((QUEEN, ROOK, BISHOP, KNIGHT) if promotes else (None,)):
+                        if promotion is not None:
+                            placed = [(pieceColor, promotion if sq == toSq and pieceColor == mover else placedType, sq)
+                                      for pieceColor, placedType, sq in placed]
+                        result = tablebase.probePieces(placed, mover == BLACK)
+                        if result is None:
+                            raise FileNotFoundError(f"{signature} needs the tables it turns into, generate them first")
+                        outcome, plies = result
+                        if outcome == LOSS:  # The opponent is lost after it
+                            wins[plies + 1].append(offset + index)
+                            canAvoidLoss[offset + index] = 1
+                        elif outcome == DRAW:
+                            canAvoidLoss[offset + index] = 1
+                        else:
+                            exitLoss[offset + index] = max(exitLoss[offset + index], plies + 1)
+            if legalMoves == 0:
+                if isAttacked(squares[kings[mover]], other, pieces, squares):
+                    losses[0].append(offset + index)  # Checkmated
+                continue  # Stalemate stays a draw
+            if exits and movesLeft[offset + index] == 0 and not canAvoidLoss[offset + index]:
+                losses[exitLoss[offset + index]].append(offset + index)
+
+    # Pass 3: settle the positions ply by ply outwards from the mates, walking back along unmoves
+    values = bytearray(size)
+    settled = 0
+    for plies in range(MAX_PLIES + 1):
+        for waves, won in ((losses, False), (wins, True)):
+            for position in waves[plies]:
+                if values[position]:
+                    continue
+                values[position] = plies if won else 128 + plies
+                settled += 1
+                side, index = divmod(position, positions)
+                previous = colors[1 - side]  # The side that moved into this position
+                squares = [index // powers[i] % 64 for i in range(count)]
+                occupied = set(squares)
+                for i, (color, pieceType) in enumerate(pieces):
+                    if color != previous:
+                        continue
+                    for fromSq in pieceUnmoves(pieceType, color, squares[i], occupied):
+                        parent = (1 - side) * positions + index + (fromSq - squares[i]) * powers[i]
+                        if not legal[parent] or values[parent]:
+                            continue
+                        if not won:
+                            wins[plies + 1].append(parent)
+                        else:
+                            movesLeft[parent] -= 1
+                            if movesLeft[parent] == 0 and not canAvoidLoss[parent]:
+                                losses[max(plies + 1, exitLoss[parent])].append(parent)
+            waves[plies] = None
+        if plies == MAX_PLIES and any(not values[position] for position in wins[plies + 1] + losses[plies + 1]):
+            raise ValueError(f"{signature} has mates longer than {MAX_PLIES} plies")
+
+    os.makedirs(tablebase.directory, exist_ok=True)
+    with open(tablebase.path(signature), "wb") as f:
+        f.write(values)
+    tablebase.tables.pop(signature, None)
+    log(f"{signature}: {sum(legal)} legal positions, {settled} won or lost")
+
+def generateWithDependencies(signature, tablebase, log=print):
+    """Generates the ending after every smaller table it needs that is missing"""
+    for child in sorted(dependencies(signature), key=len):
+        if tablebase.table(child) is None:
+            generateWithDependencies(child, tablebase, log)
+    if tablebase.table(signature) is None:
+        generate(signature, tablebase, log)
+
+def allSignatures(count):
+    """The canonical endings with count pieces that aren't drawn by insufficient material"""
+    signatures = set()
+    for others in itertools.combinations_with_replacement((QUEEN, ROOK, BISHOP, KNIGHT, PAWN), count - 2):
+        for whiteCount in range(len(others) + 1):
+            for whiteOthers in set(itertools.combinations(others, whiteCount)):
+                blackOthers = list(others)
+                for pieceType in whiteOthers:
+                    blackOthers.remove(pieceType)
+                pieces = [(WHITE, KING)] + [(WHITE, t) for t in whiteOthers] + [(BLACK, KING)] + \
+                    [(BLACK, t) for t in blackOthers]
+                if isCanonical(pieces) and not insufficientMaterial(pieces):
+                    signatures.add(signatureOf(pieces))
+    return sorted(signatures)
+
+def main():
+    parser = argparse.ArgumentParser(description="Endgame tablebase generator and viewer")
+    parser.add_argument("--dir", default=TABLEBASE_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    generateCommand = commands.add_parser("generate", help="generate endings, e.g. KQvK KRvK KPvK")
+    generateCommand.add_argument("signatures", nargs="*")
+    generateCommand.add_argument("--all", type=int, choices=(3, 4), help="every ending with this many pieces")
+    probeCommand = commands.add_parser("probe", help="look a position up")
+    probeCommand.add_argument("--fen", required=True)
+    args = parser.parse_args()
+    tablebase = Tablebase(args.dir)
+
+    if args.command == "generate":
+        signatures = list(args.signatures) + (allSignatures(args.all) if args.all else [])
+        for signature in signatures:
+            generateWithDependencies(signature, tablebase)
+        return
+
+    from engine import GameState
+    result = tablebase.probe(GameState(args.fen))
+    if result is None:
+        print("not in the tablebases")
+    else:
+        outcome, plies = result
+        print({WIN: f"win, mate in {(plies + 1) // 2}", DRAW: "draw", LOSS: f"loss, mated in {plies // 2}"}[outcome])
+
+if __name__ == "__main__":
+    main()
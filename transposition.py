@@ -0,0 +1,59 @@
+"""Fixed-size transposition table for the alpha-beta search, keyed by GameState.zobristKey"""
+from array import array
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2  # Score is exact, at least (fail high) or at most (fail low)
+ENTRY_BYTES = 17  # 8 byte key + 8 byte packed data + 1 byte search generation
+SCORE_OFFSET = 1 << 31  # Scores are stored unsigned
+
+class TranspositionTable:
+    """Buckets of two entries: the first keeps the deepest search of the positions hashing there (unless it is from
+    an older search), the second is always replaced. Entries are packed into parallel arrays so the table's memory
+    stays at sizeMB however many positions are stored, and it can be kept from one move of a game to the next."""
+
+    def __init__(self, sizeMB=16):
+        buckets = 1
+        while buckets * 2 * 2 * ENTRY_BYTES <= sizeMB * 1024 * 1024:
+            buckets *= 2  # Power of two so the bucket is the low bits of the key
+        self.mask = buckets - 1
+        self.keys = array("Q", bytes(8 * 2 * buckets))
+        self.data = array("Q", bytes(8 * 2 * buckets))  # moveID | depth << 20 | bound << 28 | score << 30
+        self.generations = bytearray(2 * buckets)
+        self.generation = 1  # 0 marks an empty slot
+        self.probes = self.hits = self.stores = 0
+
+    def newSearch(self):
+        """Ages the stored entries, so the depth-preferred slots can be taken by the next search"""
+        self.generation = self.generation % 255 + 1
+
+    def clear(self):
+        self.keys = array("Q", bytes(8 * len(self.keys)))
+        self.data = array("Q", bytes(8 * len(self.data)))
+        self.generations = bytearray(len(self.generations))
+        self.probes = self.hits = self.stores = 0
+
+    def probe(self, key):
+        """Returns (depth, bound, score, moveID) stored for the position, or None"""
+        self.probes += 1
+        slot = (key & self.mask) << 1
+        for i in (slot, slot + 1):
+            if self.keys[i] == key and self.generations[i]:
+                self.hits += 1
+                data = self.data[i]
+                return data >> 20 & 0xFF, data >> 28 & 3, (data >> 30) - SCORE_OFFSET, data & 0xFFFFF
+        return None
+
+    def store(self, key, depth, bound, score, moveID):
+        self.stores += 1
+        slot = (key & self.mask) << 1
+        if self.keys[slot] != key and self.generations[slot] == self.generation and \
+                self.data[slot] >> 20 & 0xFF > depth:
+            slot += 1  # The depth-preferred slot holds a deeper search of this search, so use the other one
+        self.keys[slot] = key
+        self.data[slot] = moveID | depth << 20 | bound << 28 | (score + SCORE_OFFSET) << 30
+        self.generations[slot] = self.generation
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def stats(self):
+        return {"probes": self.probes, "hits": self.hits, "stores": self.stores, "hitRate": round(self.hitRate(), 3)}